@@ -0,0 +1,93 @@
+'''
+Measure config read throughput across many threads, while a writer keeps
+publishing new versions of the config.
+
+    $ python benchmarks/read_throughput.py --threads 1 2 4 8 16
+
+Run it with a free-threaded build (python3.13t) to see reads scale with the
+number of threads, since readers never take a lock.
+'''
+import os
+import sys
+import time
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from doconf import DoconfConfig  # noqa: E402
+
+
+class BenchConfig(DoconfConfig):
+    '''
+    name: doconf_bench
+
+    {default}
+
+    [server]
+    HOST (str:"127.0.0.1"): the host
+    PORT (int:8080): the port
+    TIMEOUT (float:1.5): the timeout
+    DEBUG (bool:false): debug mode
+    '''
+    pass
+
+
+def run(config, threads, duration, write_interval):
+    stop = threading.Event()
+    counts = [0] * threads
+
+    def reader(i):
+        n = 0
+        while not stop.is_set():
+            for _ in range(1000):
+                sect = config['server']
+                sect['HOST']
+                sect['PORT']
+                sect['TIMEOUT']
+            n += 1000
+        counts[i] = n
+
+    def writer():
+        port = 8080
+        while not stop.wait(write_interval):
+            port += 1
+            config.update('server', PORT=port)
+
+    workers = [
+        threading.Thread(target=reader, args=(i,)) for i in range(threads)
+    ]
+    workers.append(threading.Thread(target=writer))
+    for t in workers:
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in workers:
+        t.join()
+    return sum(counts) / duration
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', '-t', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--duration', '-d', type=float, default=2.0)
+    parser.add_argument(
+        '--write-interval', '-w', type=float, default=0.001,
+        help='seconds between published updates',
+    )
+    args = parser.parse_args()
+
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    print('python {} ({})'.format(
+        sys.version.split()[0], 'GIL' if gil else 'free-threaded',
+    ))
+    config = BenchConfig.load(text='')
+    for threads in args.threads:
+        rate = run(config, threads, args.duration, args.write_interval)
+        print('{:>3} threads: {:>12,.0f} section reads/s'.format(
+            threads, rate,
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -8,7 +8,11 @@ from .config import DoconfConfig
 from .exceptions import (
     DoconfError, DoconfClassError, DoconfFileError, DoconfTypeError,
     DoconfBadConfigError, DoconfUndefinedEnvironmentError,
+    DoconfResolverError, DoconfSnapshotError,
 )
+from .history import HistoryStore
+from .parser import register_fragment
+from .resolvers import register_resolver, unregister_resolver, clear_cache
 
 __title__ = 'doconf'
 __version__ = '0.2.0'
@@ -20,6 +24,13 @@ __all__ = (
     'DoconfTypeError',
     'DoconfBadConfigError',
     'DoconfUndefinedEnvironmentError',
+    'DoconfResolverError',
+    'DoconfSnapshotError',
+    'HistoryStore',
+    'register_fragment',
+    'register_resolver',
+    'unregister_resolver',
+    'clear_cache',
 )
 __author__ = 'Johan Nestaas <johannestaas@gmail.com>'
 __license__ = 'GPLv3'
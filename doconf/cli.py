@@ -1,8 +1,17 @@
 import os
 import sys
+import time
+import signal
 
 
-def load_class(module, class_name):
+def load_class(module, class_name, static=True):
+    # Avoid importing the whole application just to read a docstring, unless
+    # the class can't be recreated from its source alone.
+    if static:
+        from .static import load_class_static
+        cls = load_class_static(module, class_name)
+        if cls is not None:
+            return cls
     sys.path = ['.'] + sys.path
     submod = __import__(module)
     for next_mod in module.split('.')[1:]:
@@ -38,7 +47,15 @@ def main():
     )
     s.add_argument('--config-path', '-c', help='direct path to config')
     s.add_argument(
-        '--env', '-e', default='default', help='the environment to use',
+        '--env', '-e', default='default',
+        help='the environment to use, or "all" to validate every environment',
+    )
+    s.add_argument(
+        '--record', action='store_true',
+        help='record the config in its history if it validates',
+    )
+    s.add_argument(
+        '--store', help='history directory, by default in $XDG_DATA_HOME',
     )
 
     s = subs.add_parser(
@@ -56,8 +73,98 @@ def main():
         help='output directory, default to current directory',
     )
 
+    s = subs.add_parser(
+        'serve', help='load the config once and serve it to other processes',
+    )
+    s.add_argument(
+        'class_path',
+        help=(
+            'path to the module and class, '
+            'eg: custom_example.config:CustomConfig'
+        ),
+    )
+    s.add_argument('--config-path', '-c', help='direct path to config')
+    s.add_argument(
+        '--env', '-e', default='default', help='the environment to use',
+    )
+    s.add_argument(
+        '--socket', '-s',
+        help='unix socket to serve on, by default derived from the app name',
+    )
+    s.add_argument(
+        '--interval', '-i', type=float,
+        help='seconds between checks for changes to the config file',
+    )
+
+    s = subs.add_parser(
+        'history', help='list the configs recorded in the history',
+    )
+    s.add_argument(
+        'class_path',
+        help=(
+            'path to the module and class, '
+            'eg: custom_example.config:CustomConfig'
+        ),
+    )
+    s.add_argument(
+        '--env', '-e', default=None,
+        help='only list this environment, default to every environment',
+    )
+    s.add_argument(
+        '--store', help='history directory, by default in $XDG_DATA_HOME',
+    )
+
+    s = subs.add_parser(
+        'rollback', help='make a config recorded in the history active again',
+    )
+    s.add_argument(
+        'class_path',
+        help=(
+            'path to the module and class, '
+            'eg: custom_example.config:CustomConfig'
+        ),
+    )
+    s.add_argument(
+        'digest', nargs='?',
+        help='digest or unique prefix of the snapshot, default to the one '
+        'recorded before the active one',
+    )
+    s.add_argument(
+        '--env', '-e', default='default', help='the environment to use',
+    )
+    s.add_argument(
+        '--store', help='history directory, by default in $XDG_DATA_HOME',
+    )
+
+    s = subs.add_parser(
+        'scan', help='list every config class defined under a directory',
+    )
+    s.add_argument('package_dir', help='directory of python sources to scan')
+    s.add_argument(
+        '--jobs', '-j', type=int, default=None,
+        help='number of processes to parse files with, default to cpu count',
+    )
+
     args = parser.parse_args()
 
+    if args.cmd == 'scan':
+        from .static import scan
+        for result in scan(args.package_dir, jobs=args.jobs):
+            if result['error']:
+                print('{} (error: {})'.format(
+                    result['class_path'], result['error'],
+                ))
+            elif result['needs_import']:
+                print('{} (needs import: {})'.format(
+                    result['class_path'], result['needs_import'],
+                ))
+            else:
+                print('{} (name: {}, environments: {})'.format(
+                    result['class_path'], result['name'],
+                    ', '.join(result['envs']),
+                ))
+        return
+
     if ':' not in getattr(args, 'class_path', ''):
         parser.print_usage()
         print()
@@ -66,7 +173,12 @@ def main():
         sys.exit(1)
     else:
         module, class_name = args.class_path.split(':', 1)
-        cls = load_class(module, class_name)
+        # Only the commands that never load values read the schema statically,
+        # since values must be resolved by whatever the application registers
+        # when it's imported.
+        cls = load_class(
+            module, class_name, static=args.cmd in ('find', 'generate'),
+        )
 
     if args.cmd == 'find':
         paths = cls.possible_paths()
@@ -83,17 +195,57 @@ def main():
         else:
             print('Would have loaded: {}'.format(first))
     elif args.cmd == 'validate':
-        conf = cls.load(path=args.config_path, env=args.env)
-        for sect_name in conf._values.keys():
-            sect_title = 'Section {!r}'.format(sect_name)
-            sect_title = '{}\n{}'.format(sect_title, '-' * len(sect_title))
-            print(sect_title)
-            sect = conf[sect_name]
-            for key, val in sorted(sect.items()):
-                print('{} ({}) = {!r}'.format(
-                    key, val.__class__.__name__, val,
+        if args.env.lower() == 'all':
+            confs = cls.load_all_envs(path=args.config_path)
+        else:
+            confs = {args.env: cls.load(path=args.config_path, env=args.env)}
+        for env_name, conf in confs.items():
+            if len(confs) > 1:
+                env_title = 'Environment {!r}'.format(env_name)
+                print('{}\n{}\n'.format(env_title, '=' * len(env_title)))
+            for sect_name in conf._values.keys():
+                sect_title = 'Section {!r}'.format(sect_name)
+                sect_title = '{}\n{}'.format(
+                    sect_title, '-' * len(sect_title),
+                )
+                print(sect_title)
+                sect = conf[sect_name]
+                for key, val in sorted(sect.items()):
+                    print('{} ({}) = {!r}'.format(
+                        key, val.__class__.__name__, val,
+                    ))
+                print()
+        if args.record:
+            from .history import HistoryStore
+            store = HistoryStore(cls, root=args.store)
+            for env_name, conf in confs.items():
+                print('Recorded {} as {}'.format(
+                    env_name, store.record(conf),
                 ))
-            print()
+    elif args.cmd == 'history':
+        from .history import HistoryStore
+        store = HistoryStore(cls, root=args.store)
+        entries = store.history(env=args.env)
+        if not entries:
+            print('Nothing recorded in {}'.format(store.root))
+        for entry in entries:
+            print('{} {} {} {} {}'.format(
+                '*' if entry['active'] else ' ',
+                entry['digest'][:12],
+                time.strftime(
+                    '%Y-%m-%d %H:%M:%S', time.localtime(entry['created']),
+                ),
+                entry['env'],
+                entry['path'] or '-',
+            ))
+    elif args.cmd == 'rollback':
+        from .history import HistoryStore
+        store = HistoryStore(cls, root=args.store)
+        if args.digest:
+            digest = store.activate(args.digest)
+        else:
+            digest = store.activate(store.previous(args.env))
+        print('Active snapshot of {} is now {}'.format(cls._NAME, digest))
     elif args.cmd == 'generate':
         for env_name, env in cls._ENVS.items():
             filename = '{}.{}.config'.format(
@@ -102,7 +254,13 @@ def main():
             path = os.path.join(args.out, filename)
             text = ''
             for sect in env.sections:
-                text += '[{}]\n'.format(sect.name)
+                if sect.pattern:
+                    # Any section whose name starts with the prefix matches,
+                    # so give an example of one.
+                    text += '# Sections matching [{}]\n'.format(sect.name)
+                    text += '[{}example]\n'.format(sect.prefix)
+                else:
+                    text += '[{}]\n'.format(sect.name)
                 for var in sect.variables:
                     extra = '# ({}) '.format(var.typ.__name__)
                     desc = var.desc.split()
@@ -123,6 +281,23 @@ def main():
             with open(path, 'w') as f:
                 f.write(text)
             print('Dumped example to {}'.format(path))
+    elif args.cmd == 'serve':
+        from .daemon import ConfigServer, WATCH_INTERVAL
+        server = ConfigServer(
+            cls, path=args.config_path, env=args.env,
+            socket_path=args.socket,
+            interval=args.interval or WATCH_INTERVAL,
+        )
+        server.bind()
+        # Exit through serve_forever's cleanup, which removes the socket.
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        print('Serving {} from {} on {}'.format(
+            cls._NAME, server.config._path, server.socket_path,
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
     else:
         parser.print_usage()
 
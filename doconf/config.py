@@ -5,13 +5,32 @@ doconf.config
 Core doconf logic lies here.
 '''
 import os
+import sys
+import array
+import marshal
+import struct
+import threading
+import contextlib
+import contextvars
 from configparser import ConfigParser
 
 from .exceptions import (
-    DoconfClassError, DoconfFileError, DoconfTypeError, DoconfBadConfigError,
-    DoconfUndefinedEnvironmentError,
+    DoconfError, DoconfClassError, DoconfFileError, DoconfTypeError,
+    DoconfBadConfigError, DoconfUndefinedEnvironmentError, DoconfSnapshotError,
 )
 from .parser import parse_docs, parse_as
+from .indexed import IndexedConfig
+from .resolvers import resolve_values
+from .interpolation import evaluation_order, interpolate
+
+# Bumped whenever the layout of a serialized snapshot changes.
+SNAPSHOT_VERSION = 1
+# Length prefix of a snapshot published to shared memory.
+SNAPSHOT_HEADER = struct.Struct('<Q')
+
+# Values overridden in the current thread or task with ``override``, as a dict
+# of config to dict of section name to values. Replaced, never modified.
+_OVERRIDES = contextvars.ContextVar('doconf_overrides', default=None)
 
 
 class MetaConfig(type):
@@ -41,28 +60,362 @@ class DoconfSection(dict):
         return super().__contains__(item.upper())
 
 
+class DoconfLazySection(DoconfSection):
+    '''
+    Section which keeps the raw strings read from the config, and coerces each
+    one into its type on first access, caching the result.
+    '''
+
+    def __init__(self, values, raw, coerce):
+        super().__init__(
+            (key, val) for key, val in values.items() if key not in raw
+        )
+        self._raw = raw
+        self._coerce = coerce
+
+    def __getitem__(self, item):
+        key = item.upper()
+        try:
+            return dict.__getitem__(self, key)
+        except KeyError:
+            if key not in self._raw:
+                raise
+        # Racing threads coerce the same raw string to an equal value, so it
+        # doesn't matter whose ends up cached.
+        val = self._coerce(key, self._raw[key])
+        dict.__setitem__(self, key, val)
+        return val
+
+    def get(self, item, **kwargs):
+        if item.upper() in self._raw:
+            return self[item]
+        return super().get(item, **kwargs)
+
+    def __contains__(self, item):
+        return item.upper() in self._raw or super().__contains__(item)
+
+    def validate_all(self):
+        '''
+        Coerce every value that hasn't been yet.
+        '''
+        for key in self._raw:
+            self[key]
+
+    def __iter__(self):
+        self.validate_all()
+        return super().__iter__()
+
+    def __len__(self):
+        self.validate_all()
+        return super().__len__()
+
+    def __eq__(self, other):
+        self.validate_all()
+        return super().__eq__(other)
+
+    def __ne__(self, other):
+        self.validate_all()
+        return super().__ne__(other)
+
+    def __repr__(self):
+        self.validate_all()
+        return super().__repr__()
+
+    def keys(self):
+        self.validate_all()
+        return super().keys()
+
+    def values(self):
+        self.validate_all()
+        return super().values()
+
+    def items(self):
+        self.validate_all()
+        return super().items()
+
+
+class DoconfArraySection:
+    '''
+    Read only section of int, float and bool variables, declared like
+    ``[weights] (array)``, which stores its values unboxed in an
+    ``array.array`` instead of a dict.
+    The array is exposed as ``array``, which supports the buffer protocol, so
+    it can be read by NumPy without copying.
+    '''
+
+    def __init__(self, schema, values, name=None):
+        self._schema = schema
+        typecode, self._index, self._types = schema.array_layout()
+        items = [values[var.name] for var in schema.variables]
+        try:
+            self.array = array.array(typecode, items)
+        except (TypeError, OverflowError) as e:
+            raise DoconfBadConfigError(
+                'cant store values of array section {!r}: {}'.format(
+                    name or schema.name, str(e),
+                )
+            )
+        if typecode == 'd':
+            # Ints stored as doubles are only exact up to 2**53.
+            for var, val, stored in zip(schema.variables, items, self.array):
+                if var.typ is int and stored != val:
+                    raise DoconfBadConfigError(
+                        'cant store {}={!r} exactly in array section {!r} '
+                        'of floats'.format(var.name, val, name or schema.name)
+                    )
+
+    def __getitem__(self, item):
+        i = self._index[item.upper()]
+        return self._types[i](self.array[i])
+
+    def get(self, item, default=None):
+        try:
+            return self[item]
+        except KeyError:
+            return default
+
+    def __contains__(self, item):
+        return item.upper() in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __eq__(self, other):
+        try:
+            return dict(self.items()) == dict(other.items())
+        except AttributeError:
+            return NotImplemented
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, dict(self.items()))
+
+    def keys(self):
+        return self._index.keys()
+
+    def values(self):
+        return [typ(val) for typ, val in zip(self._types, self.array)]
+
+    def items(self):
+        return list(zip(self._index, self.values()))
+
+    def indices(self, names):
+        '''
+        Positions of the variables in ``array``, to read them in bulk.
+        '''
+        return [self._index[name.upper()] for name in names]
+
+    def take(self, names):
+        '''
+        Read several variables at once, as an array of the same typecode.
+        '''
+        return array.array(
+            self.array.typecode, [self.array[i] for i in self.indices(names)],
+        )
+
+
+class DoconfOverlaySection:
+    '''
+    Read only view of a section with a few variables overridden by
+    ``DoconfConfig.override``, which only holds the overridden values and
+    reads every other one from the shared section.
+    '''
+
+    def __init__(self, base, overrides):
+        self._base = base
+        self._overrides = overrides
+
+    def __getitem__(self, item):
+        try:
+            return self._overrides[item.upper()]
+        except KeyError:
+            return self._base[item]
+
+    def get(self, item, default=None):
+        try:
+            return self[item]
+        except KeyError:
+            return default
+
+    def __contains__(self, item):
+        return item.upper() in self._overrides or item in self._base
+
+    def __iter__(self):
+        return iter(self._base.keys())
+
+    def __len__(self):
+        return len(self._base)
+
+    def __eq__(self, other):
+        try:
+            return dict(self.items()) == dict(other.items())
+        except AttributeError:
+            return NotImplemented
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, dict(self.items()))
+
+    def keys(self):
+        return self._base.keys()
+
+    def values(self):
+        return [self[key] for key in self._base.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self._base.keys()]
+
+
+@contextlib.contextmanager
+def _attach_shared(name):
+    '''
+    Map a shared memory segment another process published, without registering
+    it with this process's resource tracker, which would unlink it from under
+    the publisher when this process exits.
+    '''
+    from multiprocessing import shared_memory
+    if sys.version_info >= (3, 13) or os.name == 'nt':
+        # There's no resource tracker on windows.
+        kwargs = {'track': False} if os.name != 'nt' else {}
+        shm = shared_memory.SharedMemory(name=name, **kwargs)
+        try:
+            yield shm.buf
+        finally:
+            shm.close()
+        return
+    # Before python 3.13 attaching through SharedMemory always registers the
+    # segment, so it's mapped directly instead.
+    import mmap
+    import _posixshmem
+    fd = _posixshmem.shm_open('/' + name.lstrip('/'), os.O_RDONLY, mode=0o600)
+    try:
+        mm = mmap.mmap(fd, os.fstat(fd).st_size, prot=mmap.PROT_READ)
+    finally:
+        os.close(fd)
+    try:
+        yield mm
+    finally:
+        mm.close()
+
+
+def _close(config):
+    if isinstance(config, IndexedConfig):
+        config.close()
+
+
+class _ParseCache:
+    '''
+    Raw and coerced values shared by configs parsed from the same file.
+    '''
+    def __init__(self):
+        self.raw = {}
+        self.coerced = {}
+
+
 class DoconfConfig(metaclass=MetaConfig):
 
     @classmethod
-    def load(cls, path=None, text=None, env='DEFAULT'):
+    def load(
+        cls, path=None, text=None, env='DEFAULT', mmap=False, lazy=False,
+        source='file', socket_path=None, url=None,
+    ):
+        '''
+        Load and parse the config, from the text passed, the path passed or
+        the first config file discovered in ``possible_paths``.
+        With ``mmap`` enabled the file is memory mapped and only the sections
+        the schema declares are decoded, for very large config files.
+        With ``lazy`` enabled values are only coerced into their types when
+        they're first accessed, though missing variables still fail here.
+        With ``source='daemon'`` the config is fetched from ``doconf serve``
+        listening on ``socket_path``, falling back to loading it from the
+        path discovered if no daemon is serving it.
+        With ``url`` the config is fetched over HTTP, only downloading and
+        parsing it again when it changed, and falling back to the last copy
+        fetched when the server can't be reached.
+        '''
+        if url is not None:
+            if (
+                path is not None or text is not None or mmap or
+                source != 'file' or socket_path is not None
+            ):
+                raise DoconfError(
+                    'url can not be combined with another config source'
+                )
+            # Only imported when used, since it pulls in http.client.
+            from .remote import load_from_url
+            return load_from_url(cls, url, env=env, lazy=lazy)
+        if source == 'daemon':
+            # The daemon serves the values it parsed from the file it watches,
+            # eagerly, so these can't apply to them.
+            if path is not None or text is not None or mmap or lazy:
+                raise DoconfError(
+                    'source {!r} can not be combined with path, text, mmap '
+                    'or lazy'.format(source)
+                )
+            from .daemon import load_from_daemon
+            conf = load_from_daemon(cls, env=env, socket_path=socket_path)
+            if conf is not None:
+                return conf
+        elif source != 'file':
+            raise DoconfError('unknown config source {!r}'.format(source))
+        if text is None:
+            path = cls._find_path(path)
+        config = cls._read_config(path=path, text=text, mmap=mmap)
+        try:
+            return cls(config=config, env=env, path=path, lazy=lazy)
+        finally:
+            _close(config)
+
+    @classmethod
+    def load_all_envs(cls, path=None, text=None, mmap=False, lazy=False):
+        '''
+        Load the config once for every environment the schema defines,
+        returning a dict of environment name to config.
+        The file is only read and tokenized once, and raw and coerced values
+        are shared between the environments.
+        '''
+        if text is None:
+            path = cls._find_path(path)
+        config = cls._read_config(path=path, text=text, mmap=mmap)
+        cache = _ParseCache()
+        try:
+            return {
+                env_name: cls(
+                    config=config, env=env_name, cache=cache, path=path,
+                    lazy=lazy,
+                )
+                for env_name in cls._ENVS
+            }
+        finally:
+            _close(config)
+
+    @classmethod
+    def _find_path(cls, path=None):
+        if path and not os.path.isfile(path):
+            raise DoconfFileError('No config file at {!r}'.format(path))
+        if not path:
+            discoverable = cls.possible_paths()
+            for path in discoverable:
+                if os.path.isfile(path):
+                    break
+            else:
+                raise DoconfFileError(
+                    'no config path discovered for {!r}, checked:\n - {}'
+                    .format(cls._NAME, '\n - '.join(discoverable))
+                )
+        return path
+
+    @classmethod
+    def _read_config(cls, path=None, text=None, mmap=False):
+        if text is None and mmap:
+            return IndexedConfig(path)
         config = ConfigParser()
         if text is not None:
             config.read_string(text)
         else:
-            if path and not os.path.isfile(path):
-                raise DoconfFileError('No config file at {!r}'.format(path))
-            if not path:
-                discoverable = cls.possible_paths()
-                for path in discoverable:
-                    if os.path.isfile(path):
-                        break
-                else:
-                    raise DoconfFileError(
-                        'no config path discovered for {!r}, checked:\n - {}'
-                        .format(cls._NAME, '\n - '.join(discoverable))
-                    )
             config.read(path)
-        return cls(config=config, env=env)
+        return config
 
     @classmethod
     def possible_paths(cls):
@@ -100,59 +453,438 @@ class DoconfConfig(metaclass=MetaConfig):
                 discoverable.append(path)
         return discoverable
 
-    def __init__(self, config=None, env='DEFAULT'):
-        self._config = config
-        if env.lower() not in self.__class__._ENVS:
+    @classmethod
+    def loads(cls, data):
+        '''
+        Restore a config from a snapshot created with ``dumps``, without
+        discovering, reading or parsing any config file.
+        The snapshot must have been produced by this same schema.
+        '''
+        try:
+            version, fingerprint, env, values = marshal.loads(data)
+        except (EOFError, ValueError, TypeError):
+            raise DoconfSnapshotError('corrupt config snapshot')
+        if version != SNAPSHOT_VERSION:
+            raise DoconfSnapshotError(
+                'unsupported snapshot version {!r}'.format(version)
+            )
+        if fingerprint != cls._FINGERPRINT:
+            raise DoconfSnapshotError(
+                'snapshot was created with a different schema than {!r}'
+                .format(cls._NAME)
+            )
+        return cls._from_values(values, env=env)
+
+    @classmethod
+    def attach(cls, name):
+        '''
+        Restore a config from a snapshot that another process published to
+        shared memory with ``publish``.
+        '''
+        try:
+            with _attach_shared(name) as buf, memoryview(buf) as view:
+                size, = SNAPSHOT_HEADER.unpack_from(view, 0)
+                start = SNAPSHOT_HEADER.size
+                with view[start:start + size] as data:
+                    return cls.loads(data)
+        except FileNotFoundError:
+            raise DoconfSnapshotError(
+                'no shared config snapshot named {!r}'.format(name)
+            )
+
+    @classmethod
+    def _env_schema(cls, env):
+        if env.lower() not in cls._ENVS:
             raise DoconfUndefinedEnvironmentError(
                 'missing environment {!r}'.format(env)
             )
-        self._default = self.__class__._ENVS[env.lower()]
-        self._values = {}
+        return cls._ENVS[env.lower()]
+
+    @classmethod
+    def _from_values(cls, values, env='DEFAULT'):
+        conf = cls.__new__(cls)
+        conf._setup(env=env)
+        conf._values = {
+            name: conf._make_section(name, sect_values)
+            for name, sect_values in values.items()
+        }
+        return conf
+
+    def __init__(
+        self, config=None, env='DEFAULT', cache=None, path=None, lazy=False,
+    ):
+        self._setup(config=config, env=env, cache=cache, path=path, lazy=lazy)
         self.parse()
 
+    def _setup(
+        self, config=None, env='DEFAULT', cache=None, path=None, lazy=False,
+    ):
+        self._config = config
+        self._cache = cache
+        self._path = path
+        self._lazy = lazy
+        self._default = self.__class__._env_schema(env)
+        self._values = {}
+        # Identifies the config's overrides, shared with its snapshots.
+        self._override_key = object()
+        # Only serializes writers against each other, readers never take it.
+        self._write_lock = threading.Lock()
+
     def parse(self):
+        '''
+        Parse the current config into a new version of the values, and publish
+        it once it's complete.
+        '''
+        sections = self._section_schemas()
+        raw_values = self._read_raw(sections)
+        # Ordered before references are resolved, so resolved values, such as
+        # secrets, are never interpolated themselves.
+        order = evaluation_order(sections, raw_values)
+        interpolated = set(order)
+        resolve_values(raw_values)
         self._parsed = {}
-        for d_sect in self._default.sections:
-            sect_values = DoconfSection()
-            self._values[d_sect.name] = sect_values
-            self._values[d_sect.name].update(d_sect.defaults)
+        values = {}
+        for sect_name, d_sect in sections.items():
+            raw_sect = {
+                var_name: val
+                for var_name, val in raw_values[sect_name].items()
+                # Evaluated below, after whatever they reference.
+                if (sect_name, var_name) not in interpolated
+            }
+            if self._lazy and not d_sect.array:
+                values[sect_name] = DoconfLazySection(
+                    d_sect.defaults, raw_sect,
+                    self._section_coercer(d_sect),
+                )
+                continue
+            sect_values = DoconfSection(d_sect.defaults)
+            values[sect_name] = sect_values
+            for var_name, val in raw_sect.items():
+                var = d_sect.variables_by_name[var_name]
+                sect_values[var.name] = self._coerce(var, val, sect_name)
+
+        def lookup(sect_name, var_name):
+            return values[sect_name][var_name]
+
+        for sect_name, var_name in order:
+            val = interpolate(
+                raw_values[sect_name][var_name], sect_name, lookup,
+            )
+            var = sections[sect_name].variables_by_name[var_name]
+            values[sect_name][var.name] = self._coerce(var, val, sect_name)
+        for sect_name, d_sect in sections.items():
+            if d_sect.array:
+                values[sect_name] = self._make_section(
+                    sect_name, values[sect_name], d_sect,
+                )
+        self._publish(values)
+
+    def _section_schemas(self):
+        '''
+        Map the name of every section the config will have to its schema: the
+        sections the schema declares by name, then every section in the
+        config file matched by a pattern section like ``[shard:*]``.
+        '''
+        sections = {
+            d_sect.name: d_sect
+            for d_sect in self._default.sections
+            if not d_sect.pattern
+        }
+        if len(sections) < len(self._default.sections):
+            for name in self._config.sections():
+                d_sect = self._default.match(name)
+                if d_sect is not None and d_sect.pattern:
+                    sections[name] = d_sect
+        return sections
+
+    def _publish(self, values):
+        # A single reference assignment, which is atomic with or without the
+        # GIL, so readers see either the old or the new version in full.
+        self._values = values
+
+    def reload(self, path=None, text=None):
+        '''
+        Re-read and parse the config, then publish the new values.
+        It reloads from the path it was loaded from unless another path or text
+        is passed. Readers keep seeing the previous values until the new ones
+        are complete, and if parsing fails they're left untouched.
+        '''
+        if text is None:
+            path = self._find_path(path or self._path)
+        config = self._read_config(
+            path=path, text=text,
+            mmap=isinstance(self._config, IndexedConfig),
+        )
+        try:
+            with self._write_lock:
+                self._config = config
+                self.parse()
+                self._path = path
+        finally:
+            _close(config)
+
+    def update(self, section, **values):
+        '''
+        Publish a new version of the values with some variables in a section
+        changed. Sections are never modified in place, so readers holding on
+        to the previous version of the section aren't affected.
+        Strings are parsed as they would be in a config file.
+        '''
+        sect_name = section.lower()
+        with self._write_lock:
+            if sect_name not in self._values:
+                raise DoconfBadConfigError('no section {!r}'.format(section))
+            sect_values = dict(self._values[sect_name].items())
+            for var_name, val in values.items():
+                var = self._schema_var(sect_name, var_name)
+                sect_values[var.name] = self._check_value(var, val)
+            new_values = dict(self._values)
+            new_values[sect_name] = self._make_section(sect_name, sect_values)
+            self._publish(new_values)
+
+    def _make_section(self, sect_name, sect_values, d_sect=None):
+        d_sect = d_sect or self._default.match(sect_name)
+        if d_sect is not None and d_sect.array:
+            return DoconfArraySection(d_sect, sect_values, name=sect_name)
+        return DoconfSection(sect_values)
+
+    def snapshot(self):
+        '''
+        A consistent view of the current values across every section, which
+        doesn't change when new values are published.
+        Nothing is copied, it shares the current values.
+        '''
+        conf = self.__class__.__new__(self.__class__)
+        conf._setup(env=self._default.name)
+        conf._values = self._values
+        conf._override_key = self._override_key
+        return conf
+
+    @contextlib.contextmanager
+    def override(self, section, **values):
+        '''
+        Override some variables in a section for the current thread or asyncio
+        task only, until the block exits::
+
+            with config.override('server', TIMEOUT=1):
+                handle(request)
+
+        Nothing is copied: the overridden values are layered over the shared
+        ones, so the cost depends on the number of overrides, not the size of
+        the config. Strings are parsed as they would be in a config file.
+        '''
+        sect_name = section.lower()
+        if sect_name not in self._values:
+            raise DoconfBadConfigError('no section {!r}'.format(section))
+        checked = {}
+        for var_name, val in values.items():
+            var = self._schema_var(sect_name, var_name)
+            checked[var.name] = self._check_value(var, val)
+        current = _OVERRIDES.get() or {}
+        sections = dict(current.get(self._override_key, {}))
+        sections[sect_name] = dict(sections.get(sect_name, {}), **checked)
+        overrides = dict(current)
+        overrides[self._override_key] = sections
+        token = _OVERRIDES.set(overrides)
+        try:
+            yield self
+        finally:
+            _OVERRIDES.reset(token)
+
+    def _overlay(self, sect_name, sect, overrides):
+        sections = overrides.get(self._override_key)
+        if sections is None or sect_name not in sections:
+            return sect
+        if isinstance(sect, DoconfArraySection):
+            # Arrays can't be layered, so they're rebuilt with the overrides.
+            return self._make_section(
+                sect_name, dict(sect.items(), **sections[sect_name]),
+            )
+        return DoconfOverlaySection(sect, sections[sect_name])
+
+    def _schema_var(self, sect_name, var_name):
+        d_sect = self._default.match(sect_name)
+        try:
+            return d_sect.variables_by_name[var_name.upper()]
+        except (AttributeError, KeyError):
+            raise DoconfBadConfigError(
+                'no variable {!r} in section {!r}'.format(var_name, sect_name)
+            )
+
+    def _check_value(self, var, val):
+        if isinstance(val, str):
+            return self._coerce(var, val)
+        if var.typ is float and type(val) is int:
+            return float(val)
+        if val is not None and type(val) is not var.typ:
+            raise DoconfTypeError(
+                'variable {!r} must be {!r}, not {!r}'.format(
+                    var.name, var.typ, val,
+                )
+            )
+        return val
+
+    def validate_all(self):
+        '''
+        Coerce every value a lazily loaded config hasn't coerced yet, raising
+        any error that would otherwise only come up when the value is read.
+        '''
+        for sect in self._values.values():
+            if isinstance(sect, DoconfLazySection):
+                sect.validate_all()
+
+    def _section_coercer(self, d_sect):
+        def coerce(var_name, val):
+            return self._coerce(d_sect.variables_by_name[var_name], val)
+        return coerce
+
+    def _location(self, sect_name, var_name=None):
+        '''
+        Prefix for errors about the config file pointing at where they are,
+        which is only worked out for memory mapped files, as they can be too
+        large to search by hand.
+        '''
+        if isinstance(self._config, IndexedConfig):
+            return '{}: '.format(self._config.locate(sect_name, var_name))
+        return ''
+
+    def _coerce(self, var, val, sect_name=None):
+        if self._cache is not None:
+            key = (var.typ, val)
             try:
-                sect = self._config[d_sect.name]
+                return self._cache.coerced[key]
+            except KeyError:
+                pass
+        try:
+            coerced = parse_as(val, var.typ)
+        except DoconfTypeError as e:
+            raise DoconfBadConfigError(
+                '{}variable {!r} cant be parsed as {!r} ({!r}): {}'.format(
+                    self._location(sect_name, var.name) if sect_name else '',
+                    var.name, var.typ, val, str(e),
+                )
+            )
+        if self._cache is not None:
+            self._cache.coerced[key] = coerced
+        return coerced
+
+    def _raw_value(self, sect, sect_name, var_name):
+        '''
+        The raw string for a variable in a config section, or None if it's not
+        there.
+        '''
+        if self._cache is None:
+            return sect.get(var_name)
+        key = (sect_name, var_name)
+        try:
+            return self._cache.raw[key]
+        except KeyError:
+            val = self._cache.raw[key] = sect.get(var_name)
+            return val
+
+    def _read_raw(self, sections):
+        '''
+        Collect the raw strings of every variable the schema declares, checking
+        that required sections and variables are present.
+        '''
+        raw_values = {}
+        for sect_name, d_sect in sections.items():
+            raw_sect = raw_values[sect_name] = {}
+            try:
+                sect = self._config[sect_name]
             except KeyError:
                 if d_sect.has_required:
                     raise DoconfBadConfigError(
-                        'missing section {!r} and it has required variables'
-                        .format(d_sect.name)
+                        '{}missing section {!r} and it has required variables'
+                        .format(self._location(sect_name), sect_name)
                     )
-                else:
-                    # Missing section, but it doesn't have any required
-                    # variables.
-                    continue
+                # Missing section, but it doesn't have any required
+                # variables, so only computed defaults are left to evaluate.
+                sect = {}
             for var in d_sect.variables:
-                try:
-                    val = sect[var.name]
-                except KeyError:
-                    # Check if it's required.
-                    if not var.has_default:
-                        raise DoconfBadConfigError(
-                            'cant find config variable {!r} in section {!r}'
-                            .format(var.name, d_sect.name)
-                        )
-                    continue
-                try:
-                    val = parse_as(val, var.typ)
-                except DoconfTypeError as e:
+                val = self._raw_value(sect, sect_name, var.name)
+                if val is not None:
+                    raw_sect[var.name] = val
+                elif var.computed:
+                    raw_sect[var.name] = var.default
+                # Check if it's required.
+                elif not var.has_default:
                     raise DoconfBadConfigError(
-                        'variable {!r} cant be parsed as {!r} ({!r}): {}'
-                        .format(var.name, var.typ, val, str(e))
+                        '{}cant find config variable {!r} in section {!r}'
+                        .format(self._location(sect_name), var.name, sect_name)
                     )
-                sect_values[var.name] = val
+        return raw_values
+
+    def dumps(self):
+        '''
+        Serialize the resolved values along with the schema fingerprint into a
+        compact binary snapshot, restorable with ``loads``.
+        '''
+        values = {
+            name: dict(sect.items()) for name, sect in self._values.items()
+        }
+        return marshal.dumps((
+            SNAPSHOT_VERSION, self.__class__._FINGERPRINT,
+            self._default.name, values,
+        ))
+
+    def publish(self, name=None):
+        '''
+        Publish a snapshot to shared memory so child processes can ``attach``
+        to it by name instead of loading the config themselves.
+        Returns the ``SharedMemory`` segment, which the caller owns and should
+        ``close`` and ``unlink`` once the workers are done with it.
+        '''
+        from multiprocessing import shared_memory
+        data = self.dumps()
+        shm = shared_memory.SharedMemory(
+            name=name, create=True, size=SNAPSHOT_HEADER.size + len(data),
+        )
+        SNAPSHOT_HEADER.pack_into(shm.buf, 0, len(data))
+        start = SNAPSHOT_HEADER.size
+        shm.buf[start:start + len(data)] = data
+        return shm
+
+    def sections(self, pattern=None):
+        '''
+        Iterate over the name and values of every section, or of the sections
+        matched by a pattern section in the schema like ``shard:*``, without
+        copying them.
+        '''
+        values = self._values
+        overrides = _OVERRIDES.get()
+        if pattern is None:
+            matched = iter(values.items())
+        else:
+            d_sect = self._default.section_by_name.get(pattern.lower())
+            if d_sect is None:
+                raise KeyError(pattern)
+            matched = (
+                (name, sect) for name, sect in values.items()
+                if self._default.match(name) is d_sect
+            )
+        if overrides is None:
+            return matched
+        return (
+            (name, self._overlay(name, sect, overrides))
+            for name, sect in matched
+        )
 
     def __getitem__(self, item):
-        return self._values[item.lower()]
+        name = item.lower()
+        sect = self._values[name]
+        overrides = _OVERRIDES.get()
+        if overrides is None:
+            return sect
+        return self._overlay(name, sect, overrides)
 
     def get(self, item, **kwargs):
-        return self._values.get(item.lower(), **kwargs)
+        name = item.lower()
+        values = self._values
+        overrides = _OVERRIDES.get()
+        if overrides is None or name not in values:
+            return values.get(name, **kwargs)
+        return self._overlay(name, values[name], overrides)
 
     def __contains__(self, item):
         return item.lower() in self._values
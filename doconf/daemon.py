@@ -0,0 +1,247 @@
+'''
+doconf.daemon
+-------------
+
+A local daemon which loads a config once, watches the file for changes, and
+serves snapshots of it to other processes over a unix domain socket.
+
+The wire format is a single exchange per connection. The client sends the
+version it already has as ``REQUEST``, zero if none, and the daemon replies
+with its current version and the length of the snapshot as ``RESPONSE``,
+followed by the snapshot itself. If the client's version is current the
+length is zero and no snapshot follows.
+'''
+import os
+import sys
+import stat
+import socket
+import struct
+import tempfile
+import threading
+import socketserver
+
+from .exceptions import DoconfError, DoconfSnapshotError
+
+REQUEST = struct.Struct('<Q')
+RESPONSE = struct.Struct('<QQ')
+# Process, user and group ids of the peer of a unix socket.
+PEERCRED = struct.Struct('3i')
+
+# Seconds between checks of the config file for changes.
+WATCH_INTERVAL = 1.0
+# Seconds a client waits on the daemon before falling back to a local load.
+FETCH_TIMEOUT = 2.0
+
+_CACHE = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def _runtime_dir():
+    runtime_dir = os.getenv('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return runtime_dir
+    # Anyone could create the socket first in the shared temp directory, so
+    # it goes in a directory only this user can write to.
+    path = os.path.join(
+        tempfile.gettempdir(), 'doconf-{}'.format(os.getuid()),
+    )
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(path)
+    if (
+        not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or
+        st.st_mode & 0o077
+    ):
+        raise DoconfError(
+            'runtime directory {!r} is not private to this user'.format(path)
+        )
+    return path
+
+
+def default_socket_path(config_cls, env='DEFAULT'):
+    return os.path.join(_runtime_dir(), 'doconf-{}-{}.sock'.format(
+        config_cls._NAME, env.lower(),
+    ))
+
+
+def _check_peer(sock, socket_path):
+    '''
+    Only trust a daemon run by this same user, since its snapshots are loaded
+    with marshal, which isn't safe on untrusted input.
+    '''
+    if hasattr(socket, 'SO_PEERCRED'):
+        creds = sock.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, PEERCRED.size,
+        )
+        _, uid, _ = PEERCRED.unpack(creds)
+    else:
+        uid = os.stat(socket_path).st_uid
+    if uid != os.getuid():
+        raise DoconfSnapshotError(
+            'config daemon on {!r} is run by another user, uid {}'.format(
+                socket_path, uid,
+            )
+        )
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 16))
+        if not chunk:
+            raise ConnectionError('connection closed by the config daemon')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+class _Handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        try:
+            known, = REQUEST.unpack(_recv_exact(self.request, REQUEST.size))
+        except ConnectionError:
+            return
+        version, data = self.server.doconf.current
+        if known == version:
+            data = b''
+        self.request.sendall(RESPONSE.pack(version, len(data)))
+        if data:
+            self.request.sendall(data)
+
+
+class ConfigServer:
+    '''
+    Serves snapshots of a config to other processes, reloading it whenever the
+    config file changes.
+    '''
+
+    def __init__(
+        self, config_cls, path=None, env='DEFAULT', socket_path=None,
+        interval=WATCH_INTERVAL,
+    ):
+        self.config = config_cls.load(path=path, env=env)
+        self.socket_path = socket_path or default_socket_path(config_cls, env)
+        self.interval = interval
+        self._stat = self._stat_config()
+        # Versions start at a random point so clients never mistake a
+        # restarted daemon's snapshot for the one they already have.
+        version = int.from_bytes(os.urandom(4), 'little') << 32
+        # Swapped as a whole, so handlers always see a matching pair.
+        self.current = (version, self.config.dumps())
+        self._server = None
+        self._stop = threading.Event()
+
+    def _stat_config(self):
+        try:
+            st = os.stat(self.config._path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def check(self):
+        '''
+        Reload and publish a new version if the config file changed.
+        A config that no longer validates is reported, and the last good one
+        keeps being served.
+        '''
+        stat = self._stat_config()
+        if stat is None or stat == self._stat:
+            return False
+        self._stat = stat
+        try:
+            self.config.reload()
+        except DoconfError as e:
+            sys.stderr.write('not reloading {}: {}\n'.format(
+                self.config._path, str(e),
+            ))
+            return False
+        self.current = (self.current[0] + 1, self.config.dumps())
+        return True
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def bind(self):
+        if os.path.exists(self.socket_path):
+            # Only take over the socket if nothing is serving on it anymore.
+            try:
+                fetch(self.socket_path, timeout=self.interval)
+            except OSError:
+                os.unlink(self.socket_path)
+            else:
+                raise DoconfError(
+                    'a config daemon is already serving on {!r}'
+                    .format(self.socket_path)
+                )
+        self._server = socketserver.ThreadingUnixStreamServer(
+            self.socket_path, _Handler,
+        )
+        self._server.daemon_threads = True
+        self._server.doconf = self
+
+    def serve_forever(self):
+        if self._server is None:
+            self.bind()
+        watcher = threading.Thread(target=self._watch, daemon=True)
+        watcher.start()
+        try:
+            self._server.serve_forever()
+        finally:
+            self._stop.set()
+            self._server.server_close()
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+
+    def shutdown(self):
+        self._stop.set()
+        self._server.shutdown()
+
+
+def fetch(socket_path, known_version=0, timeout=FETCH_TIMEOUT):
+    '''
+    Fetch the current snapshot from a config daemon, returning its version and
+    the snapshot, or None for the snapshot if ``known_version`` is current.
+    '''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        _check_peer(sock, socket_path)
+        sock.sendall(REQUEST.pack(known_version))
+        version, size = RESPONSE.unpack(_recv_exact(sock, RESPONSE.size))
+        data = _recv_exact(sock, size) if size else None
+    return version, data
+
+
+def load_from_daemon(config_cls, env='DEFAULT', socket_path=None):
+    '''
+    Load a config from the daemon serving it, reusing the config already
+    fetched by this process if the daemon's version hasn't changed.
+    Every call returns its own snapshot of the values fetched, so a caller
+    updating its config doesn't change the config of any other caller.
+    Returns None if no daemon is serving a snapshot this class can restore.
+    '''
+    try:
+        socket_path = socket_path or default_socket_path(config_cls, env)
+    except (OSError, DoconfError):
+        return None
+    key = (config_cls, env.lower(), socket_path)
+    with _CACHE_LOCK:
+        version, conf = _CACHE.get(key, (0, None))
+    try:
+        new_version, data = fetch(socket_path, known_version=version)
+        if data is None:
+            return conf and conf.snapshot()
+        conf = config_cls.loads(data)
+    except (OSError, DoconfSnapshotError):
+        return None
+    if conf._default.name != env.lower():
+        return None
+    with _CACHE_LOCK:
+        _CACHE[key] = (new_version, conf)
+    return conf.snapshot()
@@ -47,3 +47,18 @@ class DoconfUndefinedEnvironmentError(DoconfError):
     Raised when you try to load a config with an environment that wasnt defined.
     '''
     pass
+
+
+class DoconfResolverError(DoconfError):
+    '''
+    Raised when a referenced value, like ``env:DB_PASS``, can't be resolved.
+    '''
+    pass
+
+
+class DoconfSnapshotError(DoconfError):
+    '''
+    Raised when a serialized config snapshot is corrupt or was produced by a
+    different schema.
+    '''
+    pass
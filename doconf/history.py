@@ -0,0 +1,294 @@
+'''
+doconf.history
+--------------
+
+A local content-addressed store of every config that validated, so a bad
+config can be rolled back without finding the old file and parsing it again.
+
+Each section's values are stored once as an object named by the hash of its
+contents, so sections that didn't change between versions are shared. A
+snapshot is a small manifest of section name to object, named by the hash of
+its objects, the schema fingerprint and the environment, so it changes
+whenever a resolved value does, like a rotated secret.
+Each environment has a pointer to its active snapshot, and rolling back only
+swaps that pointer.
+'''
+import os
+import time
+import hashlib
+import marshal
+from collections import OrderedDict
+
+from .exceptions import DoconfError, DoconfSnapshotError
+
+# Bumped whenever the layout of objects or manifests changes.
+HISTORY_VERSION = 2
+# Versions recorded by this process kept in memory, to roll back to them
+# without reading them back.
+RECORDED_LIMIT = 8
+
+
+def default_history_dir():
+    data_home = os.getenv('XDG_DATA_HOME') or os.path.expanduser(
+        '~/.local/share'
+    )
+    return os.path.join(data_home, 'doconf', 'history')
+
+
+def _write_atomic(path, data):
+    import tempfile
+    # Created readable by the owner only, since resolved values can be secrets.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class HistoryStore:
+    '''
+    History of the configs of one config class, stored under ``root``, by
+    default ``$XDG_DATA_HOME/doconf/history/<name>``.
+    '''
+
+    def __init__(self, config_cls, root=None):
+        self.config_cls = config_cls
+        self.root = root or os.path.join(
+            default_history_dir(), config_cls._NAME,
+        )
+        self._objects = os.path.join(self.root, 'objects')
+        self._snapshots = os.path.join(self.root, 'snapshots')
+        self._active = os.path.join(self.root, 'active')
+        # The last values recorded by this process, which are never modified
+        # in place, so rolling back to them is only a reference swap.
+        self._recorded = OrderedDict()
+
+    def _makedirs(self):
+        for path in (self._objects, self._snapshots, self._active):
+            os.makedirs(path, mode=0o700, exist_ok=True)
+
+    def _put_object(self, sect):
+        data = marshal.dumps(tuple(sorted(sect.items())))
+        digest = hashlib.sha256(data).hexdigest()
+        path = os.path.join(self._objects, digest)
+        # Already stored by an earlier snapshot with the same section.
+        if not os.path.exists(path):
+            _write_atomic(path, data)
+        return digest
+
+    def _get_object(self, digest):
+        try:
+            with open(os.path.join(self._objects, digest), 'rb') as f:
+                return dict(marshal.loads(f.read()))
+        except (OSError, EOFError, ValueError, TypeError):
+            raise DoconfSnapshotError(
+                'missing or corrupt history object {!r}'.format(digest)
+            )
+
+    def record(self, conf, activate=True):
+        '''
+        Store the current values of a config, and make them the active
+        snapshot unless ``activate`` is False. Returns the snapshot's digest.
+        '''
+        conf_cls = conf.__class__
+        env = conf._default.name
+        # Read once, so every section comes from the same version.
+        values = conf._values
+        self._makedirs()
+        objects = {
+            name: self._put_object(sect) for name, sect in values.items()
+        }
+        digest = hashlib.sha256(marshal.dumps((
+            conf_cls._FINGERPRINT, env, tuple(sorted(objects.items())),
+        ))).hexdigest()
+        path = os.path.join(self._snapshots, digest)
+        # Content addressed, so a snapshot recorded again keeps its place in
+        # the history.
+        if not os.path.exists(path):
+            _write_atomic(path, marshal.dumps((
+                HISTORY_VERSION, conf_cls._FINGERPRINT, env, time.time(),
+                conf._path and os.path.abspath(conf._path), objects,
+            )))
+        self._recorded[digest] = (env, values)
+        self._recorded.move_to_end(digest)
+        while len(self._recorded) > RECORDED_LIMIT:
+            self._recorded.popitem(last=False)
+        if activate:
+            self._set_active(conf._default.name, digest)
+        return digest
+
+    def _manifest(self, digest):
+        try:
+            with open(os.path.join(self._snapshots, digest), 'rb') as f:
+                (
+                    version, fingerprint, env, created, path, objects,
+                ) = marshal.loads(f.read())
+        except OSError:
+            raise DoconfSnapshotError(
+                'no snapshot {!r} in {!r}'.format(digest, self.root)
+            )
+        except (EOFError, ValueError, TypeError):
+            raise DoconfSnapshotError('corrupt snapshot {!r}'.format(digest))
+        if version != HISTORY_VERSION:
+            raise DoconfSnapshotError(
+                'unsupported history version {!r}'.format(version)
+            )
+        return {
+            'digest': digest,
+            'fingerprint': fingerprint,
+            'env': env,
+            'created': created,
+            'path': path,
+            'objects': objects,
+        }
+
+    def resolve(self, prefix):
+        '''
+        The full digest of the snapshot starting with ``prefix``.
+        '''
+        if not prefix or prefix.strip('0123456789abcdef'):
+            raise DoconfSnapshotError(
+                'invalid snapshot digest {!r}'.format(prefix)
+            )
+        if os.path.isfile(os.path.join(self._snapshots, prefix)):
+            return prefix
+        try:
+            digests = os.listdir(self._snapshots)
+        except OSError:
+            digests = []
+        matches = [d for d in digests if d.startswith(prefix)]
+        if len(matches) != 1:
+            raise DoconfSnapshotError(
+                '{} snapshots match {!r} in {!r}'.format(
+                    'no' if not matches else 'several', prefix, self.root,
+                )
+            )
+        return matches[0]
+
+    def active(self, env='DEFAULT'):
+        '''
+        Digest of the active snapshot of an environment, or None if nothing
+        was recorded for it.
+        '''
+        try:
+            with open(os.path.join(self._active, env.lower())) as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def _set_active(self, env, digest):
+        self._makedirs()
+        _write_atomic(
+            os.path.join(self._active, env), digest.encode('utf8') + b'\n',
+        )
+
+    def activate(self, digest):
+        '''
+        Make a snapshot the active one for its environment, by swapping the
+        pointer to it.
+        '''
+        digest = self.resolve(digest)
+        self._set_active(self._manifest(digest)['env'], digest)
+        return digest
+
+    def history(self, env=None):
+        '''
+        Every snapshot recorded, oldest first, as dicts describing them.
+        Only the snapshots of ``env`` are listed if it's passed.
+        '''
+        try:
+            digests = os.listdir(self._snapshots)
+        except OSError:
+            return []
+        entries = []
+        for digest in digests:
+            if digest.startswith('tmp'):
+                continue
+            entry = self._manifest(digest)
+            if env is not None and entry['env'] != env.lower():
+                continue
+            entry['active'] = digest == self.active(entry['env'])
+            entries.append(entry)
+        entries.sort(key=lambda entry: entry['created'])
+        return entries
+
+    def previous(self, env='DEFAULT'):
+        '''
+        Digest of the snapshot of an environment recorded before its active
+        one.
+        '''
+        digest = self.active(env)
+        if digest is None:
+            raise DoconfSnapshotError('no active snapshot to roll back from')
+        entries = self.history(env=env)
+        digests = [entry['digest'] for entry in entries]
+        index = digests.index(digest)
+        if index == 0:
+            raise DoconfSnapshotError(
+                'no snapshot recorded before {!r}'.format(digest)
+            )
+        return digests[index - 1]
+
+    def _values(self, conf, digest):
+        if digest in self._recorded:
+            env, values = self._recorded[digest]
+        else:
+            manifest = self._manifest(digest)
+            if manifest['fingerprint'] != self.config_cls._FINGERPRINT:
+                raise DoconfSnapshotError(
+                    'snapshot was created with a different schema than {!r}'
+                    .format(self.config_cls._NAME)
+                )
+            env = manifest['env']
+            loaded = {}
+            values = {}
+            for name, obj in manifest['objects'].items():
+                if obj not in loaded:
+                    loaded[obj] = self._get_object(obj)
+                values[name] = loaded[obj]
+            if conf is not None:
+                values = {
+                    name: conf._make_section(name, sect_values)
+                    for name, sect_values in values.items()
+                }
+        if conf is not None and env != conf._default.name:
+            raise DoconfError(
+                'snapshot {!r} is for environment {!r}, not {!r}'.format(
+                    digest, env, conf._default.name,
+                )
+            )
+        return env, values
+
+    def load(self, digest=None, env='DEFAULT'):
+        '''
+        Restore the active snapshot of an environment, or the one ``digest``
+        names, as a config without reading or parsing any config file.
+        '''
+        digest = self.resolve(digest) if digest else self.active(env)
+        if digest is None:
+            raise DoconfSnapshotError(
+                'no snapshot recorded in {!r}'.format(self.root)
+            )
+        env, values = self._values(None, digest)
+        return self.config_cls._from_values(values, env=env)
+
+    def rollback(self, conf, digest=None):
+        '''
+        Publish a recorded snapshot into a live config and make it the active
+        one, by default the snapshot recorded before the active one.
+        Readers switch over with the same reference swap as ``reload``, and
+        nothing is parsed. Returns the digest rolled back to.
+        '''
+        env = conf._default.name
+        digest = self.resolve(digest) if digest else self.previous(env)
+        env, values = self._values(conf, digest)
+        with conf._write_lock:
+            conf._publish(values)
+        self._set_active(env, digest)
+        return digest
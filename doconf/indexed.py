@@ -0,0 +1,142 @@
+'''
+doconf.indexed
+--------------
+
+Reading of very large config files through a memory map.
+The file is scanned once for section headers to build an index of their byte
+offsets, and only the sections that are actually looked up get decoded and
+parsed.
+'''
+import re
+import mmap
+from configparser import ConfigParser, Error as ConfigParserError
+
+from .exceptions import DoconfBadConfigError, DoconfFileError
+
+RE_HEADER = re.compile(rb'^[ \t]*\[(?P<name>[^\]\r\n]+)\][ \t]*\r?$', re.M)
+RE_CONTENT = re.compile(rb'^[ \t]*[^#;\s]', re.M)
+
+# Bytes counted at a time when working out line numbers.
+LINENO_CHUNK = 1 << 20
+
+
+class IndexedConfig:
+    '''
+    Read only stand-in for a ConfigParser over a memory mapped file, which
+    decodes and parses each section on first access.
+    '''
+
+    def __init__(self, path, encoding='utf8'):
+        self._path = path
+        self._encoding = encoding
+        self._index = {}
+        self._parsed = {}
+        self._parser = ConfigParser()
+        try:
+            with open(path, 'rb') as f:
+                try:
+                    self._mm = mmap.mmap(
+                        f.fileno(), 0, access=mmap.ACCESS_READ,
+                    )
+                except ValueError:
+                    # Empty files can't be mapped, and have no sections anyway.
+                    self._mm = b''
+        except OSError as e:
+            raise DoconfFileError(
+                'cant read config file {!r}: {}'.format(path, str(e))
+            )
+        self._build_index()
+
+    def _build_index(self):
+        headers = [
+            (m.group('name').decode(self._encoding), m.start(), m.end())
+            for m in RE_HEADER.finditer(self._mm)
+        ]
+        first = headers[0][1] if headers else len(self._mm)
+        m = RE_CONTENT.search(self._mm, 0, first)
+        if m:
+            raise DoconfBadConfigError(
+                '{}: line {}: values before the first section header'
+                .format(self._path, self.lineno(m.start()))
+            )
+        for i, (name, start, _) in enumerate(headers):
+            end = headers[i + 1][1] if i + 1 < len(headers) else len(self._mm)
+            if name in self._index:
+                raise DoconfBadConfigError(
+                    '{}: line {}: duplicate section {!r}'
+                    .format(self._path, self.lineno(start), name)
+                )
+            self._index[name] = (start, end)
+        if self._parser.default_section in self._index:
+            self._read_section(self._parser.default_section)
+
+    def lineno(self, offset):
+        '''
+        Line number of a byte offset into the file, starting at 1.
+        '''
+        line = 1
+        for pos in range(0, offset, LINENO_CHUNK):
+            line += self._mm[pos:min(pos + LINENO_CHUNK, offset)].count(b'\n')
+        return line
+
+    def locate(self, section, option=None):
+        '''
+        Where a section, or an option in it, is in the file, like
+        ``path: line 12``, for error messages. Falls back to the section's
+        header for options that aren't in it, and to the path for sections
+        that aren't in the file.
+        '''
+        try:
+            start, end = self._index[section]
+        except KeyError:
+            return self._path
+        if option is not None:
+            m = re.compile(
+                rb'^[ \t]*' + re.escape(option.encode(self._encoding)) +
+                rb'[ \t]*[=:]', re.M | re.I,
+            ).search(self._mm, start, end)
+            if m:
+                start = m.start()
+        return '{}: line {}'.format(self._path, self.lineno(start))
+
+    def _read_section(self, name):
+        start, end = self._index[name]
+        text = self._mm[start:end].decode(self._encoding)
+        try:
+            self._parser.read_string(text, source=self._path)
+        except ConfigParserError as e:
+            errors = getattr(e, 'errors', None)
+            lineno = errors[0][0] if errors else getattr(e, 'lineno', 1)
+            raise DoconfBadConfigError(
+                '{}: line {}: {}'.format(
+                    self._path, self.lineno(start) + lineno - 1,
+                    str(e).splitlines()[0],
+                )
+            )
+
+    def sections(self):
+        return [
+            name for name in self._index
+            if name != self._parser.default_section
+        ]
+
+    def has_section(self, name):
+        return name in self._index and name != self._parser.default_section
+
+    def __getitem__(self, name):
+        try:
+            return self._parsed[name]
+        except KeyError:
+            pass
+        if not self.has_section(name):
+            raise KeyError(name)
+        self._read_section(name)
+        sect = self._parsed[name] = self._parser[name]
+        return sect
+
+    def close(self):
+        '''
+        Unmap the file. Sections already parsed stay available.
+        '''
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
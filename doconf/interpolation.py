@@ -0,0 +1,125 @@
+'''
+doconf.interpolation
+--------------------
+
+References between variables, like ``${paths:BASE}/app.log`` or ``${BASE}``
+for a variable in the same section, which are evaluated once at parse time.
+``$${`` is a literal ``${``, and quoted values are never interpolated.
+'''
+import re
+
+from .exceptions import DoconfBadConfigError
+
+RE_INTERP = re.compile(r'\$\$\{|\$\{(?P<ref>[^\}]+)\}')
+
+
+def split_reference(ref, sect_name):
+    '''
+    Split ``section:VAR`` into its section and variable name, where the
+    section defaults to the one the referencing variable is in.
+    '''
+    if ':' in ref:
+        sect_name, var_name = ref.rsplit(':', 1)
+    else:
+        var_name = ref
+    return sect_name.strip().lower(), var_name.strip().upper()
+
+
+def is_quoted(val):
+    val = val.strip()
+    return len(val) > 1 and val[0] == val[-1] and val[0] in ('"', "'")
+
+
+def needs_interpolation(val):
+    '''
+    Whether a raw value has references or escapes to evaluate.
+    '''
+    return '${' in val and not is_quoted(val)
+
+
+def references(val, sect_name):
+    return [
+        split_reference(m.group('ref'), sect_name)
+        for m in RE_INTERP.finditer(val)
+        if m.group('ref')
+    ]
+
+
+def interpolate(val, sect_name, lookup):
+    '''
+    Substitute every reference in ``val`` with ``str(lookup(section, var))``,
+    and every ``$${`` with ``${``.
+    Raises DoconfBadConfigError on references to null values.
+    '''
+    def substitute(m):
+        if not m.group('ref'):
+            return '${'
+        ref_sect, ref_var = split_reference(m.group('ref'), sect_name)
+        ref_val = lookup(ref_sect, ref_var)
+        if ref_val is None:
+            raise DoconfBadConfigError(
+                'cant interpolate {!r}, {}:{} is null'.format(
+                    val, ref_sect, ref_var,
+                )
+            )
+        return str(ref_val)
+    return RE_INTERP.sub(substitute, val)
+
+
+def evaluation_order(sections, raw_values):
+    '''
+    Topologically sort the variables whose raw values reference other
+    variables or have escapes, so each one comes after everything it
+    references.
+    ``sections`` maps the name of every section in the config to its schema.
+    Raises DoconfBadConfigError on references to undeclared variables and on
+    reference cycles.
+    '''
+    graph = {}
+    for sect_name, sect in raw_values.items():
+        for var_name, val in sect.items():
+            if not needs_interpolation(val):
+                continue
+            deps = references(val, sect_name)
+            for dep_sect, dep_var in deps:
+                if (
+                    dep_sect not in sections or
+                    dep_var not in sections[dep_sect].variables_by_name
+                ):
+                    raise DoconfBadConfigError(
+                        'variable {!r} in section {!r} references undefined '
+                        'variable {!r} in section {!r}'
+                        .format(var_name, sect_name, dep_var, dep_sect)
+                    )
+            graph[(sect_name, var_name)] = deps
+
+    order = []
+    done = set()
+    for node in graph:
+        if node in done:
+            continue
+        # Iterative depth first search, emitting nodes in post-order.
+        path = [node]
+        on_path = {node}
+        stack = [iter(graph[node])]
+        while stack:
+            for dep in stack[-1]:
+                if dep in done or dep not in graph:
+                    continue
+                if dep in on_path:
+                    cycle = path[path.index(dep):] + [dep]
+                    raise DoconfBadConfigError(
+                        'reference cycle: {}'.format(' -> '.join(
+                            '{}:{}'.format(*x) for x in cycle
+                        ))
+                    )
+                path.append(dep)
+                on_path.add(dep)
+                stack.append(iter(graph[dep]))
+                break
+            else:
+                stack.pop()
+                on_path.discard(path[-1])
+                done.add(path[-1])
+                order.append(path.pop())
+    return order
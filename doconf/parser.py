@@ -1,32 +1,119 @@
 import re
 import ast
+import hashlib
 
 from .exceptions import DoconfClassError, DoconfTypeError
+from .interpolation import RE_INTERP
 
 RE_NAME = re.compile(r'^\s*[nN][aA][mM][eE]\s*:\s*(?P<name>\S+)\s*$')
 RE_ENV = re.compile(r'^\s*\{(?P<env>[^\}]+)\}\s*$')
-RE_SECT = re.compile(r'^\s*\[(?P<section>[^\]]+)\]\s*$')
+RE_SECT = re.compile(
+    r'^\s*\[(?P<section>[^\]]+)\]\s*(\((?P<flags>[^\)]*)\))?\s*$'
+)
+RE_INCLUDE = re.compile(r'^\s*@include\s+(?P<fragment>\S+)\s*$')
 RE_VAR = re.compile(
     r'^\s*(?P<id>\w+)\s*(\((?P<typestr>[^\)]+)\))?\s*:\s*(?P<desc>.*)$'
 )
 
 
+# Fragments registered with register_fragment, by name.
+_FRAGMENTS = {}
+_FRAGMENT_DOCS = {}
+
+
 class _Env:
     def __init__(self, name):
         self.name = name.strip().lower()
         self.sections = []
         self.section_names = set()
+        self.section_by_name = {}
+        self.index = None
+
+    def match(self, name):
+        '''
+        The schema section for a section name in a config file, either declared
+        with that exact name or matched by a pattern like ``[shard:*]``.
+        '''
+        if self.index is None:
+            self.index = _SectionIndex(self.sections)
+        return self.index.match(name)
+
+
+class _SectionIndex:
+    '''
+    Matches section names against the exact and pattern sections of a schema
+    with dict lookups, one per distinct pattern prefix length at most, rather
+    than trying every pattern in turn.
+    '''
+    def __init__(self, sections):
+        self.exact = {}
+        self.prefixes = {}
+        for sect in sections:
+            if sect.pattern:
+                self.prefixes[sect.prefix] = sect
+            else:
+                self.exact[sect.name] = sect
+        self.lengths = sorted(
+            set(len(prefix) for prefix in self.prefixes), reverse=True,
+        )
+
+    def match(self, name):
+        try:
+            return self.exact[name]
+        except KeyError:
+            pass
+        # Longest prefix wins.
+        for length in self.lengths:
+            sect = self.prefixes.get(name[:length])
+            if sect is not None:
+                return sect
+        return None
 
 
 class _Section:
-    def __init__(self, name, env=None):
+    def __init__(self, name, env=None, flags=None):
         self.name = name.strip().lower()
+        self.array = False
+        for flag in (flags or '').split(','):
+            flag = flag.strip().lower()
+            if flag == 'array':
+                # Variables are stored unboxed in an array.array.
+                self.array = True
+            elif flag:
+                raise DoconfClassError(
+                    'unknown flag {!r} for section {!r}'.format(flag, name)
+                )
+        self._layout = None
+        # Pattern sections like [shard:*] apply to every section in the config
+        # file whose name starts with the prefix.
+        self.pattern = '*' in self.name
+        if self.pattern and (
+            self.name.count('*') > 1 or not self.name.endswith('*')
+        ):
+            raise DoconfClassError(
+                'section pattern {!r} can only end in a single "*"'
+                .format(self.name)
+            )
+        self.prefix = self.name[:-1] if self.pattern else None
         self.variables = []
         self.variable_names = set()
+        self.variables_by_name = {}
         self.env = env
         self.has_required = False
         self.defaults = {}
 
+    def array_layout(self):
+        '''
+        The array typecode, variable name to index map and variable types of an
+        array section, worked out once for every config using the schema.
+        '''
+        if self._layout is None:
+            types = tuple(var.typ for var in self.variables)
+            typecode = 'd' if float in types else 'q'
+            index = {var.name: i for i, var in enumerate(self.variables)}
+            self._layout = (typecode, index, types)
+        return self._layout
+
 
 class _Var:
     def __init__(
@@ -49,7 +136,16 @@ class _Var:
             self.typ = float
         else:
             raise DoconfClassError('unknown type {!r}'.format(typestr))
-        if self.has_default:
+        # Computed defaults reference other variables, so they're kept raw
+        # and evaluated when a config is parsed.
+        self.computed = bool(
+            self.has_default and self.default and
+            RE_INTERP.search(self.default)
+        )
+        if self.computed:
+            # Unquoted, since quoted values in a config are literal.
+            self.default = parse_as(self.default, str)
+        elif self.has_default:
             self.default = parse_as(self.default, self.typ)
             self.section.defaults[self.name] = self.default
         else:
@@ -69,6 +165,7 @@ class _State:
         self.env = None
         self.envs = {}
         self.dct = {}
+        self.includes = []
 
     @property
     def line(self):
@@ -133,8 +230,11 @@ class _State:
                     '{!r} is already defined as a section'.format(name)
                 )
             self.env.section_names.add(name)
-            self.sect = _Section(name, env=self.env)
+            self.sect = _Section(
+                name, env=self.env, flags=m.group('flags'),
+            )
             self.env.sections.append(self.sect)
+            self.env.section_by_name[name] = self.sect
             return True
         return False
 
@@ -176,17 +276,82 @@ class _State:
                 name, default=default, has_default=has_default,
                 typestr=typestr, desc=desc, section=self.sect,
             )
+            if self.sect.array and (
+                var.typ not in (int, float, bool) or
+                (var.has_default and var.default is None)
+            ):
+                raise DoconfClassError(
+                    '{!r} in array section {!r} must be a non-null int, '
+                    'float or bool'.format(name, self.sect.name)
+                )
             self.sect.variables.append(var)
+            self.sect.variables_by_name[name] = var
+            return True
+        return False
+
+    def handle_include(self):
+        m = RE_INCLUDE.match(self.line)
+        if m:
+            if self.env is None:
+                raise DoconfClassError(
+                    'Please specify an environment like {{DEFAULT}} before '
+                    'line:\n{!r}'.format(self.line)
+                )
+            name = m.group('fragment')
+            try:
+                sections, fragment_fp = _FRAGMENTS[name]
+            except KeyError:
+                raise DoconfClassError(
+                    'unknown fragment {!r}, register it with '
+                    'register_fragment before line:\n{!r}'
+                    .format(name, self.line)
+                )
+            for sect in sections:
+                if sect.name in self.env.section_names:
+                    raise DoconfClassError(
+                        '{!r} is already defined as a section'
+                        .format(sect.name)
+                    )
+                # Shared by reference with every other class including it.
+                self.env.section_names.add(sect.name)
+                self.env.sections.append(sect)
+                self.env.section_by_name[sect.name] = sect
+            self.includes.append((name, fragment_fp))
+            # Variables after an include need a section of their own, rather
+            # than being added to the shared fragment.
+            self.sect = None
             return True
         return False
 
     def handle_multiline(self):
         line = self.line.strip()
-        if line.startswith('>') and self.sect.variables:
+        if line.startswith('>') and self.sect and self.sect.variables:
             self.sect.variables[-1].desc += ' ' + self.line.lstrip('>').strip()
             return True
         return False
 
+    def run(self):
+        for line in self.gen_lines():
+            if self.handle_name():
+                continue
+            if self.handle_env():
+                continue
+            if self.handle_sect():
+                continue
+            if self.handle_include():
+                continue
+            if self.handle_var():
+                continue
+            if self.handle_multiline():
+                continue
+
+    def fingerprint(self):
+        # Included fragments are part of the schema too.
+        return fingerprint(self.lines + [
+            '@include {} {}'.format(name, fragment_fp)
+            for name, fragment_fp in self.includes
+        ])
+
 
 def parse_as(val, typ):
     val = val.strip()
@@ -208,7 +373,7 @@ def parse_as(val, typ):
     elif typ in (int, float, bool):
         try:
             val = ast.literal_eval(val)
-        except ValueError:
+        except (ValueError, SyntaxError):
             raise DoconfTypeError(
                 'value {!r} unable to be eval\'ed as {!r}'.format(val, typ)
             )
@@ -226,21 +391,69 @@ def parse_as(val, typ):
 
 def parse_docs(lines, dct):
     state = _State(lines)
-
-    for line in state.gen_lines():
-        if state.handle_name():
-            continue
-        if state.handle_env():
-            continue
-        if state.handle_sect():
-            continue
-        if state.handle_var():
-            continue
-        if state.handle_multiline():
-            continue
+    state.run()
 
     if not state.envs.get('default'):
         raise DoconfClassError('No DEFAULT configurations documented in class')
 
+    for env in state.envs.values():
+        env.index = _SectionIndex(env.sections)
+
     dct['_ENVS'] = state.envs
     dct['_NAME'] = state.dct['_NAME']
+    dct['_FINGERPRINT'] = state.fingerprint()
+
+
+def register_fragment(name, docs):
+    '''
+    Register sections that config classes can share with
+    ``@include <name>`` in their docstring, instead of each repeating them.
+    The fragment is only sections and variables, written like they would be
+    in a class docstring, and it's parsed once here.
+    '''
+    lines = docs.splitlines()
+    if name in _FRAGMENTS:
+        if _FRAGMENT_DOCS[name] == lines:
+            return
+        raise DoconfClassError(
+            'fragment {!r} is already registered differently'.format(name)
+        )
+    state = _State(lines)
+    # Fragments have no name or environments of their own, so sections are
+    # parsed as if they were in a {DEFAULT} environment.
+    state.dct['_NAME'] = name
+    state.env = _Env('default')
+    state.envs['default'] = state.env
+    state.run()
+    if state.dct['_NAME'] != name or len(state.envs) > 1:
+        raise DoconfClassError(
+            'fragment {!r} can only contain sections and variables'
+            .format(name)
+        )
+    _FRAGMENTS[name] = (state.env.sections, state.fingerprint())
+    _FRAGMENT_DOCS[name] = lines
+
+
+def unregistered_fragments(lines):
+    '''
+    Names of the fragments docstring lines include that aren't registered in
+    this process, in the order they're included.
+    '''
+    names = []
+    for line in lines:
+        m = RE_INCLUDE.match(line)
+        if m and m.group('fragment') not in _FRAGMENTS:
+            names.append(m.group('fragment'))
+    return names
+
+
+def fingerprint(lines):
+    '''
+    Hash of the normalized schema lines, used to check that a serialized
+    snapshot was produced by the same schema it's being restored into.
+    '''
+    digest = hashlib.sha256()
+    for line in lines:
+        digest.update(line.encode('utf8'))
+        digest.update(b'\n')
+    return digest.hexdigest()
@@ -0,0 +1,211 @@
+'''
+doconf.remote
+-------------
+
+Loading of configs served over HTTP.
+
+Connections are kept alive and pooled per host, so fetching a config again
+doesn't pay for a new TCP or TLS handshake. Requests are conditional on the
+ETag of the copy already fetched, and a ``304 Not Modified`` reuses the config
+already parsed from it. The last copy that validated is also kept on disk
+under ``$XDG_CACHE_HOME/doconf``, so a process can still start while the
+config service is unreachable.
+'''
+import os
+import hashlib
+import tempfile
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+from .exceptions import DoconfError, DoconfFileError
+
+# Seconds to wait on the config service before falling back to the cache.
+FETCH_TIMEOUT = 5.0
+# Idle connections kept open per host.
+POOL_SIZE = 4
+
+_POOL = {}
+_POOL_LOCK = threading.Lock()
+_CACHE = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def default_cache_dir():
+    cache_home = os.getenv('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(cache_home, 'doconf')
+
+
+def _cache_path(config_cls, url):
+    digest = hashlib.sha256(url.encode('utf8')).hexdigest()
+    return os.path.join(default_cache_dir(), '{}-{}.cfg'.format(
+        config_cls._NAME, digest[:32],
+    ))
+
+
+def read_cached(config_cls, url):
+    '''
+    Read the last good copy of the config fetched from ``url``, returning its
+    ETag and text, or None if there isn't one.
+    '''
+    try:
+        with open(_cache_path(config_cls, url), encoding='utf8') as f:
+            etag = f.readline().rstrip('\n')
+            return etag or None, f.read()
+    except OSError:
+        return None
+
+
+def write_cached(config_cls, url, etag, text):
+    '''
+    Keep a copy of the config on disk, replacing the previous one atomically
+    so a process starting concurrently never reads half of it.
+    '''
+    path = _cache_path(config_cls, url)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'w', encoding='utf8') as f:
+            f.write((etag or '') + '\n')
+            f.write(text)
+        os.replace(tmp_path, path)
+    except OSError:
+        # The cache is only for offline startup, not worth failing a load.
+        pass
+
+
+def _pool_key(url):
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise DoconfError('unsupported config url {!r}'.format(url))
+    return parts.scheme, parts.netloc
+
+
+def _connect(key, timeout):
+    scheme, netloc = key
+    if scheme == 'https':
+        return http.client.HTTPSConnection(netloc, timeout=timeout)
+    return http.client.HTTPConnection(netloc, timeout=timeout)
+
+
+def _checkout(key, timeout):
+    with _POOL_LOCK:
+        idle = _POOL.get(key)
+        if idle:
+            conn = idle.pop()
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            return conn, True
+    return _connect(key, timeout), False
+
+
+def _checkin(key, conn):
+    with _POOL_LOCK:
+        idle = _POOL.setdefault(key, [])
+        if len(idle) < POOL_SIZE:
+            idle.append(conn)
+            return
+    conn.close()
+
+
+def close_connections():
+    '''
+    Close every idle pooled connection.
+    '''
+    with _POOL_LOCK:
+        conns = [conn for idle in _POOL.values() for conn in idle]
+        _POOL.clear()
+    for conn in conns:
+        conn.close()
+
+
+def fetch(url, etag=None, timeout=FETCH_TIMEOUT):
+    '''
+    GET a config over a pooled connection, conditional on ``etag``.
+    Returns the status, the ETag of the response and its body decoded, or
+    None for the body if the status isn't 200.
+    '''
+    key = _pool_key(url)
+    parts = urlsplit(url)
+    target = parts.path or '/'
+    if parts.query:
+        target += '?' + parts.query
+    headers = {'Accept': 'text/plain, */*'}
+    if etag:
+        headers['If-None-Match'] = etag
+    while True:
+        conn, reused = _checkout(key, timeout)
+        try:
+            conn.request('GET', target, headers=headers)
+            response = conn.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            # The server may have closed an idle connection since it was
+            # pooled, so retry those once on a fresh one.
+            if reused:
+                continue
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            _checkin(key, conn)
+        if response.status != 200:
+            return response.status, response.getheader('ETag', etag), None
+        charset = response.headers.get_content_charset() or 'utf8'
+        return response.status, response.getheader('ETag'), body.decode(
+            charset,
+        )
+
+
+def load_from_url(
+    config_cls, url, env='DEFAULT', lazy=False, timeout=FETCH_TIMEOUT,
+):
+    '''
+    Load a config from ``url``, reusing the config already parsed by this
+    process if the server answers that it's not modified.
+    If the server can't be reached, the config parsed earlier or the last good
+    copy kept on disk is used instead.
+    Every call returns its own snapshot of the values parsed, so a caller
+    updating its config doesn't change the config of any other caller.
+    '''
+    key = (config_cls, env.lower(), url, lazy)
+    with _CACHE_LOCK:
+        etag, conf = _CACHE.get(key, (None, None))
+    cached = None
+    if conf is None:
+        cached = read_cached(config_cls, url)
+        if cached is not None:
+            etag = cached[0]
+    try:
+        status, new_etag, text = fetch(url, etag=etag, timeout=timeout)
+    except (OSError, http.client.HTTPException) as e:
+        status, error = None, str(e)
+    else:
+        error = 'HTTP status {}'.format(status)
+    if status == 304 and etag:
+        if conf is not None:
+            return conf.snapshot()
+        if cached is not None:
+            conf = config_cls.load(text=cached[1], env=env, lazy=lazy)
+            with _CACHE_LOCK:
+                _CACHE[key] = (etag, conf)
+            return conf.snapshot()
+    if status == 200:
+        conf = config_cls.load(text=text, env=env, lazy=lazy)
+        # Only cached once it validates, so a bad push can't break startup.
+        write_cached(config_cls, url, new_etag, text)
+        with _CACHE_LOCK:
+            _CACHE[key] = (new_etag, conf)
+        return conf.snapshot()
+    if conf is not None:
+        return conf.snapshot()
+    if cached is None:
+        cached = read_cached(config_cls, url)
+    if cached is None:
+        raise DoconfFileError(
+            'cant fetch config from {!r} and no copy is cached: {}'
+            .format(url, error)
+        )
+    return config_cls.load(text=cached[1], env=env, lazy=lazy)
@@ -0,0 +1,153 @@
+'''
+doconf.resolvers
+----------------
+
+Resolution of external value references, like ``env:DB_PASS`` or
+``file:/run/secrets/db``, into the raw strings they point to.
+References are resolved after the config is read and before values are
+coerced into their types.
+'''
+import os
+import re
+import time
+import threading
+
+from .exceptions import DoconfError, DoconfResolverError
+
+RE_REF = re.compile(r'^\s*(?P<scheme>[a-zA-Z][\w+.-]*):(?P<ref>.*\S)\s*$')
+
+# How long a resolved value is cached for by default, in seconds.
+DEFAULT_TTL = 60.0
+# Upper bound on threads used to resolve independent references at once.
+MAX_WORKERS = 8
+
+_RESOLVERS = {}
+_CACHE = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def register_resolver(scheme, func, ttl=DEFAULT_TTL):
+    '''
+    Register ``func(ref)`` to resolve values written as ``<scheme>:<ref>``.
+    It must return a string, which is then coerced like any value read from
+    the config file. Results are cached for ``ttl`` seconds, or not at all if
+    ``ttl`` is 0 or None.
+    '''
+    _RESOLVERS[scheme.lower()] = (func, ttl)
+
+
+def unregister_resolver(scheme):
+    _RESOLVERS.pop(scheme.lower(), None)
+    clear_cache(scheme)
+
+
+def clear_cache(scheme=None):
+    '''
+    Drop cached values, for every scheme or for just the one passed.
+    '''
+    with _CACHE_LOCK:
+        if scheme is None:
+            _CACHE.clear()
+            return
+        for key in [k for k in _CACHE if k[0] == scheme.lower()]:
+            del _CACHE[key]
+
+
+def parse_reference(val):
+    '''
+    Return ``(scheme, ref)`` if the raw value references a registered scheme,
+    or None for plain values. Quoted values are never references.
+    '''
+    m = RE_REF.match(val)
+    if m and m.group('scheme').lower() in _RESOLVERS:
+        return m.group('scheme').lower(), m.group('ref')
+    return None
+
+
+def resolve_env(ref):
+    try:
+        return os.environ[ref]
+    except KeyError:
+        raise DoconfResolverError(
+            'environment variable {!r} is not set'.format(ref)
+        )
+
+
+def resolve_file(ref):
+    with open(ref) as f:
+        return f.read().rstrip('\r\n')
+
+
+def _resolve(key):
+    scheme, ref = key
+    func, ttl = _RESOLVERS[scheme]
+    try:
+        val = func(ref)
+    except DoconfError:
+        raise
+    except Exception as e:
+        raise DoconfResolverError(
+            'cant resolve {}:{}: {}'.format(scheme, ref, str(e))
+        )
+    if not isinstance(val, str):
+        raise DoconfResolverError(
+            'resolver for {!r} returned {!r}, not a string'.format(
+                scheme, val,
+            )
+        )
+    if ttl:
+        with _CACHE_LOCK:
+            _CACHE[key] = (time.monotonic() + ttl, val)
+    return val
+
+
+def resolve_all(keys, max_workers=MAX_WORKERS):
+    '''
+    Resolve each ``(scheme, ref)`` key, from the cache where it's still fresh
+    and otherwise concurrently on a thread pool. Returns a dict of key to
+    resolved string.
+    '''
+    results = {}
+    pending = []
+    now = time.monotonic()
+    with _CACHE_LOCK:
+        for key in set(keys):
+            cached = _CACHE.get(key)
+            if cached is not None and cached[0] > now:
+                results[key] = cached[1]
+            else:
+                pending.append(key)
+    if len(pending) == 1:
+        results[pending[0]] = _resolve(pending[0])
+    elif pending:
+        from concurrent.futures import ThreadPoolExecutor
+        workers = min(max_workers, len(pending))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results.update(zip(pending, pool.map(_resolve, pending)))
+    return results
+
+
+def resolve_values(raw_values):
+    '''
+    Replace every reference in a dict of section name to dict of raw values,
+    in place.
+    '''
+    refs = {}
+    for sect_name, sect in raw_values.items():
+        for var_name, val in sect.items():
+            if '${' in val:
+                # Interpolated from other variables instead.
+                continue
+            key = parse_reference(val)
+            if key is not None:
+                refs[(sect_name, var_name)] = key
+    if not refs:
+        return raw_values
+    resolved = resolve_all(refs.values())
+    for (sect_name, var_name), key in refs.items():
+        raw_values[sect_name][var_name] = resolved[key]
+    return raw_values
+
+
+register_resolver('env', resolve_env, ttl=None)
+register_resolver('file', resolve_file)
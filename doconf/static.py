@@ -0,0 +1,198 @@
+'''
+doconf.static
+-------------
+
+Extraction of config schemas straight from the source of a module with
+``ast``, so the CLI doesn't have to import an application and all of its
+dependencies just to read a docstring.
+'''
+import os
+import sys
+import ast
+
+from .config import DoconfConfig, MetaConfig
+from .exceptions import DoconfError, DoconfClassError
+from .parser import parse_docs, unregistered_fragments
+
+
+def find_module_file(module):
+    '''
+    Find the source file of a module without importing it or its parent
+    packages, or None if it's not a plain python source file.
+    '''
+    parts = module.split('.')
+    for base in ['.'] + sys.path:
+        path = os.path.join(base or '.', *parts)
+        for candidate in (path + '.py', os.path.join(path, '__init__.py')):
+            if os.path.isfile(candidate):
+                return candidate
+    return None
+
+
+def _is_doconf_base(node):
+    if isinstance(node, ast.Name):
+        return node.id == 'DoconfConfig'
+    if isinstance(node, ast.Attribute):
+        return node.attr == 'DoconfConfig'
+    return False
+
+
+def _is_plain_schema(node):
+    '''
+    Whether a class is nothing but a DoconfConfig subclass with a literal
+    docstring, so it behaves the same whether it's imported or not.
+    '''
+    if node.decorator_list or node.keywords:
+        return False
+    if len(node.bases) != 1 or not _is_doconf_base(node.bases[0]):
+        return False
+    if ast.get_docstring(node, clean=False) is None:
+        return False
+    for stmt in node.body[1:]:
+        if isinstance(stmt, ast.Pass):
+            continue
+        if (
+            isinstance(stmt, ast.Expr) and
+            isinstance(stmt.value, ast.Constant) and
+            stmt.value.value is Ellipsis
+        ):
+            continue
+        return False
+    return True
+
+
+def _runs_code(node):
+    '''
+    Whether running a top level statement calls anything, not counting the
+    bodies of functions, which only run once they're called.
+    '''
+    if isinstance(node, ast.Call):
+        return True
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        children = node.decorator_list + [node.args]
+    elif isinstance(node, ast.Lambda):
+        children = [node.args]
+    else:
+        children = ast.iter_child_nodes(node)
+    return any(_runs_code(child) for child in children)
+
+
+def load_class_static(module, class_name):
+    '''
+    Build the config class from the docstring in the module's source, without
+    importing the module.
+    Returns None if the class can't be recreated statically, like when its
+    docstring is computed, or it defines methods of its own, or the module
+    calls anything when it's imported, like ``register_resolver``, which the
+    config could depend on.
+    '''
+    path = find_module_file(module)
+    if path is None:
+        return None
+    try:
+        with open(path, 'rb') as f:
+            tree = ast.parse(f.read(), filename=path)
+    except (OSError, SyntaxError, ValueError):
+        return None
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and node.name == class_name:
+            break
+    else:
+        return None
+    if not _is_plain_schema(node):
+        return None
+    if any(_runs_code(stmt) for stmt in tree.body):
+        return None
+    try:
+        return MetaConfig(class_name, (DoconfConfig,), {
+            '__doc__': ast.get_docstring(node, clean=False),
+            '__module__': module,
+            '__qualname__': class_name,
+        })
+    except DoconfClassError:
+        # Like an @include of a fragment the module registers when imported.
+        return None
+
+
+def scan_file(path, module):
+    '''
+    Find every DoconfConfig subclass defined at the top level of a source
+    file, returning a list of dicts describing each one.
+    Classes including fragments registered by the application, which only
+    exist once it's imported, are described by ``needs_import`` instead of
+    being parsed.
+    '''
+    results = []
+    try:
+        with open(path, 'rb') as f:
+            tree = ast.parse(f.read(), filename=path)
+    except (OSError, SyntaxError, ValueError):
+        return results
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        if not any(_is_doconf_base(base) for base in node.bases):
+            continue
+        result = {
+            'path': path,
+            'class_path': '{}:{}'.format(module, node.name),
+            'name': None,
+            'envs': [],
+            'error': None,
+            'needs_import': None,
+        }
+        docs = ast.get_docstring(node, clean=False)
+        fragments = docs and unregistered_fragments(docs.splitlines())
+        if docs is None:
+            result['error'] = 'no literal docstring'
+        elif fragments:
+            result['needs_import'] = 'includes fragment {}'.format(
+                ', '.join(repr(name) for name in fragments),
+            )
+        else:
+            dct = {}
+            try:
+                parse_docs(docs.splitlines(), dct)
+            except DoconfError as e:
+                result['error'] = str(e)
+            else:
+                result['name'] = dct['_NAME']
+                result['envs'] = list(dct['_ENVS'])
+        results.append(result)
+    return results
+
+
+def _scan_file(args):
+    return scan_file(*args)
+
+
+def scan(package_dir, jobs=None):
+    '''
+    Index every DoconfConfig subclass in the source files under a directory,
+    parsing the files in parallel across ``jobs`` processes.
+    '''
+    package_dir = os.path.abspath(package_dir)
+    # Module names are relative to the directory that would be on sys.path.
+    if os.path.isfile(os.path.join(package_dir, '__init__.py')):
+        root = os.path.dirname(package_dir)
+    else:
+        root = package_dir
+    files = []
+    for dirpath, dirnames, filenames in os.walk(package_dir):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        for filename in sorted(filenames):
+            if not filename.endswith('.py'):
+                continue
+            path = os.path.join(dirpath, filename)
+            module = os.path.relpath(path, root)[:-len('.py')]
+            module = module.replace(os.sep, '.')
+            if module.endswith('.__init__'):
+                module = module[:-len('.__init__')]
+            files.append((path, module))
+    if jobs == 1 or len(files) < 2:
+        per_file = map(_scan_file, files)
+        return [result for results in per_file for result in results]
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        per_file = pool.map(_scan_file, files, chunksize=16)
+        return [result for results in per_file for result in results]
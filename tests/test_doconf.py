@@ -1,5 +1,7 @@
 import os
 import sys
+import threading
+import subprocess
 import pytest
 
 rootdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -9,8 +11,16 @@ from doconf import (
     DoconfConfig,
     DoconfBadConfigError,
     DoconfClassError,
+    DoconfError,
+    DoconfFileError,
     DoconfTypeError,
     DoconfUndefinedEnvironmentError,
+    DoconfSnapshotError,
+    DoconfResolverError,
+    HistoryStore,
+    register_fragment,
+    register_resolver,
+    unregister_resolver,
 )
 
 
@@ -230,3 +240,1023 @@ def test_load_bad_env():
         pass
     with pytest.raises(DoconfUndefinedEnvironmentError):
         GoodConfig.load(text='', env='production')
+
+
+def test_snapshot_roundtrip():
+    conf = BasicConfig.load(text='''
+    [section1]
+    AGE=30
+    [second_section]
+    IDEA2=fazz bazz
+    ''')
+    restored = BasicConfig.loads(conf.dumps())
+    assert restored._values == conf._values
+    assert restored['section1']['age'] == 30
+    assert restored['SECOND_SECTION']['Idea2'] == 'fazz bazz'
+    assert restored['section1']['success'] == 1.0
+    assert isinstance(restored['section1']['success'], float)
+
+
+def test_snapshot_schema_mismatch():
+    class OtherConfig(DoconfConfig):
+        '''
+        name: doconf_unittest
+
+        {DEFAULT}
+
+        [section1]
+        AGE (int:20): person's age
+        '''
+        pass
+    data = BasicConfig.load(text='[second_section]\nIDEA2=x').dumps()
+    with pytest.raises(DoconfSnapshotError):
+        OtherConfig.loads(data)
+    with pytest.raises(DoconfSnapshotError):
+        BasicConfig.loads(data[:10])
+
+
+def test_snapshot_shared_memory():
+    conf = BasicConfig.load(text='[second_section]\nIDEA2=shared')
+    shm = conf.publish()
+    try:
+        restored = BasicConfig.attach(shm.name)
+        assert restored['second_section']['idea2'] == 'shared'
+        assert restored['section1']['age'] == 20
+        # A worker started on its own doesn't unlink the segment on exit.
+        worker = subprocess.run([
+            sys.executable, '-c',
+            'import sys; sys.path.insert(0, {!r}); '
+            'import test_doconf; '
+            'test_doconf.BasicConfig.attach({!r})'.format(
+                os.path.dirname(os.path.abspath(__file__)), shm.name,
+            ),
+        ], cwd=rootdir, capture_output=True, text=True)
+        assert worker.returncode == 0, worker.stderr
+        assert 'leaked' not in worker.stderr
+        restored = BasicConfig.attach(shm.name)
+        assert restored['second_section']['idea2'] == 'shared'
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+class SecretConfig(DoconfConfig):
+    '''
+    name: doconf_secrets
+
+    {DEFAULT}
+
+    [database]
+    USER (str:"admin"): the database user
+    PASSWORD (str): the database password
+    PORT (int:5432): the database port
+    '''
+    pass
+
+
+@pytest.fixture
+def vault():
+    calls = []
+
+    def lookup(ref):
+        calls.append(ref)
+        return {'db/pass': 'hunter2', 'db/port': '6543'}[ref]
+
+    register_resolver('vault', lookup, ttl=60)
+    yield calls
+    unregister_resolver('vault')
+
+
+def test_resolve_references(vault, tmp_path, monkeypatch):
+    secret = tmp_path / 'db'
+    secret.write_text('s3cret\n')
+    monkeypatch.setenv('DOCONF_TEST_USER', 'joey')
+    conf = SecretConfig.load(text='''
+    [database]
+    USER=env:DOCONF_TEST_USER
+    PASSWORD=file:{}
+    PORT=vault:db/port
+    '''.format(secret))
+    assert conf['database']['user'] == 'joey'
+    assert conf['database']['password'] == 's3cret'
+    assert conf['database']['port'] == 6543
+    conf = SecretConfig.load(text='''
+    [database]
+    USER="env:DOCONF_TEST_USER"
+    PASSWORD=vault:db/pass
+    ''')
+    assert conf['database']['user'] == 'env:DOCONF_TEST_USER'
+    assert conf['database']['password'] == 'hunter2'
+
+
+def test_resolve_references_cached(vault):
+    text = '''
+    [database]
+    PASSWORD=vault:db/pass
+    PORT=vault:db/port
+    '''
+    SecretConfig.load(text=text)
+    SecretConfig.load(text=text)
+    assert sorted(vault) == ['db/pass', 'db/port']
+
+
+def test_resolve_references_concurrently():
+    # Both lookups have to be in flight at once to get past the barrier.
+    barrier = threading.Barrier(2, timeout=5)
+
+    def lookup(ref):
+        barrier.wait()
+        return ref
+
+    register_resolver('slow', lookup, ttl=None)
+    try:
+        conf = SecretConfig.load(text='''
+        [database]
+        USER=slow:first
+        PASSWORD=slow:second
+        ''')
+    finally:
+        unregister_resolver('slow')
+    assert conf['database']['user'] == 'first'
+    assert conf['database']['password'] == 'second'
+
+
+def test_resolve_references_missing(monkeypatch):
+    monkeypatch.delenv('DOCONF_TEST_MISSING', raising=False)
+    with pytest.raises(DoconfResolverError):
+        SecretConfig.load(text='''
+        [database]
+        PASSWORD=env:DOCONF_TEST_MISSING
+        ''')
+    with pytest.raises(DoconfResolverError):
+        SecretConfig.load(text='''
+        [database]
+        PASSWORD=file:/nonexistent/doconf/secret
+        ''')
+
+
+class PathsConfig(DoconfConfig):
+    '''
+    name: doconf_paths
+
+    {DEFAULT}
+
+    [paths]
+    BASE (str:"/var/lib/app"): the base directory
+    LOG_DIR (str:"${BASE}/log"): where logs go, computed from BASE
+
+    [logger]
+    LOG_PATH (str:"${paths:LOG_DIR}/app.log"): the log file
+    PORT (int:8000): the port
+    ADMIN_PORT (int:"${PORT}1"): computed and coerced to an int
+    '''
+    pass
+
+
+def test_interpolation_defaults():
+    conf = PathsConfig.load(text='')
+    assert conf['paths']['log_dir'] == '/var/lib/app/log'
+    assert conf['logger']['log_path'] == '/var/lib/app/log/app.log'
+    assert conf['logger']['admin_port'] == 80001
+
+
+def test_interpolation_from_file():
+    conf = PathsConfig.load(text='''
+    [paths]
+    BASE=/srv
+    [logger]
+    PORT=9000
+    LOG_PATH=${paths:BASE}/${PORT}.log
+    ''')
+    assert conf['paths']['log_dir'] == '/srv/log'
+    assert conf['logger']['log_path'] == '/srv/9000.log'
+    assert conf['logger']['admin_port'] == 90001
+
+
+def test_interpolation_literal():
+    conf = PathsConfig.load(text='''
+    [paths]
+    BASE=echo $${HOME} $$${PORT}
+    ''')
+    assert conf['paths']['base'] == 'echo ${HOME} $${PORT}'
+    # Only evaluated once, so the escaped reference stays literal.
+    assert conf['paths']['log_dir'] == 'echo ${HOME} $${PORT}/log'
+    conf = PathsConfig.load(text='''
+    [paths]
+    BASE="echo ${HOME}"
+    ''')
+    assert conf['paths']['base'] == 'echo ${HOME}'
+    assert conf['paths']['log_dir'] == 'echo ${HOME}/log'
+
+
+def test_interpolation_errors():
+    with pytest.raises(DoconfBadConfigError):
+        PathsConfig.load(text='''
+        [paths]
+        BASE=${LOG_DIR}
+        ''')
+    with pytest.raises(DoconfBadConfigError):
+        PathsConfig.load(text='''
+        [paths]
+        BASE=${nope:BASE}
+        ''')
+    with pytest.raises(DoconfBadConfigError):
+        PathsConfig.load(text='''
+        [logger]
+        PORT=${paths:BASE}
+        ''')
+    # Null values can't be interpolated.
+    with pytest.raises(DoconfBadConfigError):
+        PathsConfig.load(text='''
+        [paths]
+        BASE=null
+        ''')
+
+
+def test_load_all_envs():
+    class EnvsConfig(DoconfConfig):
+        '''
+        name: my_server
+
+        {DEFAULT}
+        [server]
+        PORT (int:8080): server hosted on this port
+        HOSTNAME (str:"localhost"): this host
+
+        {PRODUCTION}
+        [server]
+        PORT (int:8082): this port
+        HOSTNAME (str): required in production
+        '''
+        pass
+
+    confs = EnvsConfig.load_all_envs(text='''
+    [server]
+    HOSTNAME=example.org
+    ''')
+    assert sorted(confs) == ['default', 'production']
+    assert confs['default']['server']['port'] == 8080
+    assert confs['production']['server']['port'] == 8082
+    assert confs['default']['server']['hostname'] == 'example.org'
+    # Identical coerced values are shared between environments.
+    assert (
+        confs['default']['server']['hostname'] is
+        confs['production']['server']['hostname']
+    )
+    with pytest.raises(DoconfBadConfigError):
+        EnvsConfig.load_all_envs(text='')
+
+
+class CounterConfig(DoconfConfig):
+    '''
+    name: doconf_counter
+
+    {DEFAULT}
+
+    [first]
+    A (int:0): always equal to B
+    B (int:0): always equal to A
+
+    [second]
+    C (int:0): always equal to A and B
+    '''
+    pass
+
+
+def test_update_publishes_new_version():
+    conf = CounterConfig.load(text='')
+    old_sect = conf['first']
+    snap = conf.snapshot()
+    conf.update('FIRST', a=1, B='2')
+    assert conf['first']['a'] == 1
+    assert conf['first']['b'] == 2
+    assert old_sect['a'] == 0
+    assert snap['first']['a'] == 0
+    with pytest.raises(DoconfBadConfigError):
+        conf.update('first', nope=1)
+    with pytest.raises(DoconfBadConfigError):
+        conf.update('nope', a=1)
+    with pytest.raises(DoconfBadConfigError):
+        conf.update('first', a='x')
+    with pytest.raises(DoconfTypeError):
+        conf.update('first', a=1.5)
+    conf.reload(text='[first]\nA=5')
+    assert conf['first']['a'] == 5
+    assert snap['first']['a'] == 0
+
+
+def test_concurrent_reads_are_consistent():
+    conf = CounterConfig.load(text='')
+    stop = threading.Event()
+    errors = []
+
+    def reader():
+        while not stop.is_set():
+            sect = conf['first']
+            if sect['a'] != sect['b']:
+                errors.append(('section', sect['a'], sect['b']))
+            snap = conf.snapshot()
+            if snap['first']['a'] != snap['second']['c']:
+                errors.append(('snapshot', snap['first']['a']))
+
+    def writer():
+        for i in range(100):
+            conf.reload(text='''
+            [first]
+            A={0}
+            B={0}
+            [second]
+            C={0}
+            '''.format(i))
+
+    readers = [threading.Thread(target=reader) for _ in range(8)]
+    writers = [threading.Thread(target=writer) for _ in range(2)]
+    for t in readers + writers:
+        t.start()
+    for t in writers:
+        t.join()
+    stop.set()
+    for t in readers:
+        t.join()
+    assert not errors
+    assert conf['first']['a'] == conf['second']['c'] == 99
+
+
+def test_load_mmap(tmp_path):
+    path = tmp_path / 'large.cfg'
+    filler = ''.join(
+        '[generated_{0}]\nVALUE={0}\n\n'.format(i) for i in range(1000)
+    )
+    path.write_text('''
+# Comment
+[section1]
+AGE=30
+NAME=joey
+
+{}
+[second_section]
+IDEA2=fazz bazz
+'''.format(filler))
+    conf = BasicConfig.load(path=str(path), mmap=True)
+    assert conf._values == BasicConfig.load(path=str(path))._values
+    assert conf['section1']['age'] == 30
+    assert conf['second_section']['idea2'] == 'fazz bazz'
+    # Only the sections in the schema were decoded.
+    assert sorted(conf._config._parsed) == ['second_section', 'section1']
+    conf.reload()
+    assert conf['section1']['name'] == 'joey'
+
+
+def test_load_mmap_errors(tmp_path):
+    path = tmp_path / 'bad.cfg'
+    path.write_text('[second_section]\nIDEA2=a\n\n[section1]\nnot a value\n')
+    with pytest.raises(DoconfBadConfigError, match='line 5'):
+        BasicConfig.load(path=str(path), mmap=True)
+    path.write_text('[second_section]\nIDEA2=a\n[second_section]\nIDEA2=b\n')
+    with pytest.raises(DoconfBadConfigError, match='line 3'):
+        BasicConfig.load(path=str(path), mmap=True)
+    path.write_text('')
+    with pytest.raises(DoconfBadConfigError):
+        BasicConfig.load(path=str(path), mmap=True)
+    # Bad and missing values point at where they are, or should be.
+    path.write_text(
+        '[second_section]\nIDEA2=a\n[section1]\nNAME=joey\nage = thirty\n'
+    )
+    with pytest.raises(DoconfBadConfigError, match='bad.cfg: line 5: '):
+        BasicConfig.load(path=str(path), mmap=True)
+    path.write_text('[section1]\nAGE=1\n\n[second_section]\nAGE2=2\n')
+    with pytest.raises(DoconfBadConfigError, match='bad.cfg: line 4: '):
+        BasicConfig.load(path=str(path), mmap=True)
+
+
+def test_lazy_coercion():
+    text = '''
+    [section1]
+    AGE=thirty
+    NAME=joey
+    [second_section]
+    AGE2=40
+    IDEA2=fazz bazz
+    '''
+    conf = BasicConfig.load(text=text, lazy=True)
+    sect = conf['second_section']
+    assert 'AGE2' not in dict.keys(sect)
+    assert sect['age2'] == 40
+    assert dict.__getitem__(sect, 'AGE2') == 40
+    assert sect['name2'] == 'guydude'
+    assert 'idea2' in sect
+    assert conf['section1']['name'] == 'joey'
+    # Bad values only fail when they're read, or validated.
+    with pytest.raises(DoconfBadConfigError):
+        conf['section1']['age']
+    with pytest.raises(DoconfBadConfigError):
+        conf.validate_all()
+    with pytest.raises(DoconfBadConfigError):
+        BasicConfig.load(text=text)
+    # Missing required variables still fail at load.
+    with pytest.raises(DoconfBadConfigError):
+        BasicConfig.load(text='[second_section]', lazy=True)
+
+
+def test_lazy_coercion_matches_eager():
+    text = '''
+    [section1]
+    DEBUG=true
+    AGE=30
+    [second_section]
+    IDEA2=fazz bazz
+    '''
+    lazy = BasicConfig.load(text=text, lazy=True)
+    eager = BasicConfig.load(text=text)
+    assert lazy._values == eager._values
+    assert (
+        sorted(lazy['section1'].items()) == sorted(eager['section1'].items())
+    )
+    assert BasicConfig.loads(lazy.dumps())._values == eager._values
+    lazy = BasicConfig.load(text=text, lazy=True)
+    assert not lazy['section1'] != eager['section1']
+    lazy = BasicConfig.load(text=text, lazy=True)
+    assert "'AGE': 30" in repr(lazy['section1'])
+
+
+def test_daemon(tmp_path, monkeypatch):
+    from doconf.daemon import ConfigServer, fetch
+    # Where the config is discovered when falling back to loading it.
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / 'doconf_unittest.cfg'
+    path.write_text('[second_section]\nIDEA2=served\n')
+    socket_path = str(tmp_path / 'daemon.sock')
+    server = ConfigServer(
+        BasicConfig, path=str(path), socket_path=socket_path, interval=60,
+    )
+    server.bind()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        conf = BasicConfig.load(source='daemon', socket_path=socket_path)
+        assert conf['second_section']['idea2'] == 'served'
+        assert conf._path is None
+        # Unchanged, so the values already fetched are reused, in a config of
+        # its own that one caller can update without affecting another.
+        again = BasicConfig.load(source='daemon', socket_path=socket_path)
+        assert again is not conf and again._values is conf._values
+        again.update('second_section', IDEA2='mine')
+        again = BasicConfig.load(source='daemon', socket_path=socket_path)
+        assert again['second_section']['idea2'] == 'served'
+        path.write_text('[second_section]\nIDEA2=changed\nAGE2=1\n')
+        assert server.check()
+        conf = BasicConfig.load(source='daemon', socket_path=socket_path)
+        assert conf['second_section']['idea2'] == 'changed'
+        # A config that no longer validates isn't published.
+        path.write_text('')
+        assert not server.check()
+        again = BasicConfig.load(source='daemon', socket_path=socket_path)
+        assert again._values is conf._values
+        # A daemon run by another user isn't trusted.
+        getuid = os.getuid
+        monkeypatch.setattr(os, 'getuid', lambda: getuid() + 1)
+        with pytest.raises(DoconfSnapshotError):
+            fetch(socket_path)
+        path.write_text('[second_section]\nIDEA2=local\n')
+        conf = BasicConfig.load(source='daemon', socket_path=socket_path)
+        assert conf._path is not None
+        monkeypatch.setattr(os, 'getuid', getuid)
+        # Options of a local load can't apply to what the daemon serves.
+        for kwargs in (
+            {'path': str(path)}, {'text': ''}, {'mmap': True}, {'lazy': True},
+        ):
+            with pytest.raises(DoconfError):
+                BasicConfig.load(
+                    source='daemon', socket_path=socket_path, **kwargs
+                )
+    finally:
+        server.shutdown()
+        thread.join()
+    assert not os.path.exists(socket_path)
+    # Without a daemon it falls back to loading the config itself.
+    path.write_text('[second_section]\nIDEA2=local\n')
+    conf = BasicConfig.load(source='daemon', socket_path=socket_path)
+    assert conf['second_section']['idea2'] == 'local'
+
+
+def test_daemon_socket_path(tmp_path, monkeypatch):
+    import tempfile
+    from doconf.daemon import default_socket_path
+    monkeypatch.delenv('XDG_RUNTIME_DIR', raising=False)
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    path = default_socket_path(BasicConfig)
+    runtime_dir = os.path.dirname(path)
+    assert runtime_dir == str(tmp_path / 'doconf-{}'.format(os.getuid()))
+    assert os.stat(runtime_dir).st_mode & 0o777 == 0o700
+    os.chmod(runtime_dir, 0o777)
+    with pytest.raises(DoconfError):
+        default_socket_path(BasicConfig)
+
+
+def test_load_url(tmp_path, monkeypatch):
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    from doconf import remote
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    served = {'body': b'[second_section]\nIDEA2=remote\n', 'etag': '"v1"'}
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            requests.append((
+                self.client_address, self.headers.get('If-None-Match'),
+            ))
+            if self.headers.get('If-None-Match') == served['etag']:
+                self.send_response(304)
+                self.send_header('ETag', served['etag'])
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('ETag', served['etag'])
+            self.send_header('Content-Length', str(len(served['body'])))
+            self.end_headers()
+            self.wfile.write(served['body'])
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    url = 'http://127.0.0.1:{}/doconf.cfg'.format(server.server_port)
+    try:
+        conf = BasicConfig.load(url=url)
+        assert conf['second_section']['idea2'] == 'remote'
+        # Not modified, so the values already parsed are reused, in a config
+        # of its own that one caller can update without affecting another.
+        again = BasicConfig.load(url=url)
+        assert again is not conf and again._values is conf._values
+        assert requests[1][1] == '"v1"'
+        again.update('second_section', IDEA2='mine')
+        assert BasicConfig.load(url=url)['second_section']['idea2'] == 'remote'
+        served.update(body=b'[second_section]\nIDEA2=changed\n', etag='"v2"')
+        conf = BasicConfig.load(url=url)
+        assert conf['second_section']['idea2'] == 'changed'
+        # All over the same kept-alive connection.
+        assert len(set(address for address, _ in requests)) == 1
+        lazy = BasicConfig.load(url=url, lazy=True)
+        assert lazy._values is not conf._values
+        with pytest.raises(DoconfError):
+            BasicConfig.load(url=url, path='/etc/doconf.cfg')
+    finally:
+        remote.close_connections()
+        server.shutdown()
+        server.server_close()
+        thread.join()
+        remote._CACHE.clear()
+    # Offline, the last good copy is loaded from disk.
+    conf = BasicConfig.load(url=url)
+    assert conf['second_section']['idea2'] == 'changed'
+    with pytest.raises(DoconfFileError):
+        BasicConfig.load(url=url + '?other')
+
+
+def test_history(tmp_path):
+    store = HistoryStore(BasicConfig, root=str(tmp_path / 'history'))
+    good = BasicConfig.load(text='[second_section]\nIDEA2=good\n')
+    first = store.record(good)
+    # Comments and formatting don't change the values, so nor the digest.
+    good = BasicConfig.load(text='# same\n[second_section]\nIDEA2 = good')
+    assert store.record(good) == first
+    bad = BasicConfig.load(text='[second_section]\nIDEA2=bad\n')
+    second = store.record(bad)
+    assert second != first
+    assert store.active() == second
+    # Unchanged sections are only stored once.
+    assert len(os.listdir(os.path.join(store.root, 'objects'))) == 3
+    assert [entry['digest'] for entry in store.history()] == [first, second]
+    values = bad._values
+    assert store.rollback(bad) == first
+    assert bad['second_section']['idea2'] == 'good'
+    assert bad['section1'] is good['section1']
+    assert store.active() == first
+    assert store.rollback(bad, second[:8]) == second
+    assert bad._values is values
+    # Another process only reads the active snapshot, without parsing.
+    other = HistoryStore(BasicConfig, root=store.root)
+    other.activate(first[:8])
+    conf = other.load()
+    assert conf['second_section']['idea2'] == 'good'
+    assert conf['section1']['age'] == 20
+    assert conf._path is None
+    other.rollback(conf, second)
+    assert conf['second_section']['idea2'] == 'bad'
+    assert other.previous() == first
+    other.activate(first)
+    with pytest.raises(DoconfSnapshotError):
+        other.previous()
+    with pytest.raises(DoconfSnapshotError):
+        other.activate('../active')
+
+
+def test_history_resolved_values(tmp_path, monkeypatch):
+    store = HistoryStore(SecretConfig, root=str(tmp_path / 'history'))
+    text = '[database]\nPASSWORD=env:DOCONF_UNITTEST_PW\n'
+    monkeypatch.setenv('DOCONF_UNITTEST_PW', 'old')
+    old = store.record(SecretConfig.load(text=text))
+    # A rotated secret is a new snapshot, though the file didn't change.
+    monkeypatch.setenv('DOCONF_UNITTEST_PW', 'new')
+    new = store.record(SecretConfig.load(text=text))
+    assert new != old
+    assert store.load()['database']['password'] == 'new'
+    assert store.load(old)['database']['password'] == 'old'
+    # Only the last few versions recorded are kept in memory.
+    monkeypatch.setattr('doconf.history.RECORDED_LIMIT', 1)
+    store.record(SecretConfig.load(text='[database]\nPASSWORD=x\n'))
+    assert len(store._recorded) == 1
+
+
+def test_override():
+    conf = BasicConfig.load(text='[second_section]\nIDEA2=shared\n')
+    base = conf['section1']
+    with conf.override('section1', AGE='30', debug=True) as overridden:
+        assert overridden is conf
+        assert conf['section1']['age'] == 30
+        assert conf['section1']['DEBUG'] is True
+        assert conf['section1']['name'] == 'greg'
+        assert conf.get('section1')['age'] == 30
+        assert dict(conf.snapshot()['section1'].items())['AGE'] == 30
+        with conf.override('section1', AGE=40):
+            assert conf['section1']['age'] == 40
+            assert conf['section1']['debug'] is True
+        assert conf['section1']['age'] == 30
+        # The shared section isn't modified.
+        assert base['age'] == 20
+        assert conf['second_section'] is conf._values['second_section']
+    assert conf['section1'] is base
+    with pytest.raises(DoconfTypeError):
+        with conf.override('section1', AGE=[1]):
+            pass
+    with pytest.raises(DoconfBadConfigError):
+        with conf.override('section1', NOPE=1):
+            pass
+    weights = WeightsConfig.load(text='')
+    with weights.override('weights', A=2):
+        assert weights['weights'].take(['A', 'B']).tolist() == [2.0, 0.25]
+    assert weights['weights']['a'] == 0.5
+
+
+def test_override_isolation():
+    import asyncio
+    conf = BasicConfig.load(text='[second_section]\nIDEA2=shared\n')
+    barrier = threading.Barrier(4)
+    seen = {}
+
+    def handle(age):
+        with conf.override('section1', AGE=age):
+            # Every thread holds its override at the same time.
+            barrier.wait()
+            seen[age] = conf['section1']['age']
+
+    threads = [threading.Thread(target=handle, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert seen == {0: 0, 1: 1, 2: 2, 3: 3}
+
+    async def task(name):
+        with conf.override('second_section', IDEA2=name):
+            await asyncio.sleep(0)
+            return conf['second_section']['idea2']
+
+    async def main():
+        return await asyncio.gather(task('a'), task('b'), task('c'))
+
+    assert asyncio.run(main()) == ['a', 'b', 'c']
+    assert conf['second_section']['idea2'] == 'shared'
+
+
+STATIC_MODULE = '''
+import doconf_expensive_dependency
+
+from doconf import DoconfConfig
+
+
+class StaticConfig(DoconfConfig):
+    """
+    name: doconf_static
+
+    {default}
+    [server]
+    PORT (int:8080): the port
+
+    {production}
+    [server]
+    PORT (int:80): the port
+    """
+    pass
+
+
+class CustomConfig(DoconfConfig):
+    """
+    name: doconf_custom
+
+    {default}
+    [server]
+    PORT (int:8080): the port
+    """
+
+    @classmethod
+    def possible_paths(cls):
+        return ['/custom/path.cfg']
+
+
+class BadConfig(DoconfConfig):
+    """
+    [server]
+    PORT (int:8080): no name or environment
+    """
+'''
+
+
+def test_load_class_static(tmp_path, monkeypatch):
+    from doconf.cli import load_class
+    pkg = tmp_path / 'static_pkg'
+    pkg.mkdir()
+    (pkg / '__init__.py').write_text('raise RuntimeError("no imports")\n')
+    (pkg / 'config.py').write_text(STATIC_MODULE)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    cls = load_class('static_pkg.config', 'StaticConfig')
+    assert 'static_pkg' not in sys.modules
+    assert cls._NAME == 'doconf_static'
+    assert cls.load(text='', env='production')['server']['port'] == 80
+    # Classes with methods of their own have to be imported.
+    with pytest.raises(RuntimeError):
+        load_class('static_pkg.config', 'CustomConfig')
+    # So do classes in modules registering something the config depends on.
+    (tmp_path / 'static_resolving.py').write_text(
+        'import doconf\n'
+        'doconf.register_resolver("unittest", lambda ref: ref.upper())\n'
+        'class StaticConfig(doconf.DoconfConfig):\n'
+        '    """\n    name: resolving\n    {default}\n    [a]\n    B: c\n'
+        '    """\n'
+    )
+    try:
+        cls = load_class('static_resolving', 'StaticConfig')
+        assert 'static_resolving' in sys.modules
+        assert cls is sys.modules['static_resolving'].StaticConfig
+    finally:
+        unregister_resolver('unittest')
+        sys.modules.pop('static_resolving', None)
+
+
+def test_scan(tmp_path):
+    from doconf.static import scan
+    pkg = tmp_path / 'static_pkg'
+    (pkg / 'sub').mkdir(parents=True)
+    (pkg / '__init__.py').write_text('')
+    (pkg / 'config.py').write_text(STATIC_MODULE)
+    (pkg / 'sub' / 'more.py').write_text(
+        'import doconf\n\n\nclass More(doconf.DoconfConfig):\n'
+        '    """\n    name: more\n    {default}\n    [a]\n    B: c\n    """\n'
+    )
+    (pkg / 'broken.py').write_text('class (:\n')
+    (pkg / 'shared.py').write_text(
+        'import doconf\n\n\nclass Shared(doconf.DoconfConfig):\n'
+        '    """\n    name: shared\n    {default}\n    @include app_db\n'
+        '    """\n'
+    )
+    for jobs in (1, 2):
+        results = {r['class_path']: r for r in scan(str(pkg), jobs=jobs)}
+        assert sorted(results) == [
+            'static_pkg.config:BadConfig',
+            'static_pkg.config:CustomConfig',
+            'static_pkg.config:StaticConfig',
+            'static_pkg.shared:Shared',
+            'static_pkg.sub.more:More',
+        ]
+        assert results['static_pkg.config:StaticConfig']['envs'] == [
+            'default', 'production',
+        ]
+        assert results['static_pkg.sub.more:More']['name'] == 'more'
+        assert results['static_pkg.config:BadConfig']['error']
+        # Its fragment is only registered once the application is imported.
+        shared = results['static_pkg.shared:Shared']
+        assert shared['error'] is None
+        assert shared['needs_import'] == "includes fragment 'app_db'"
+
+
+class ShardConfig(DoconfConfig):
+    '''
+    name: doconf_shards
+
+    {DEFAULT}
+
+    [cluster]
+    NAME (str:"main"): the cluster name
+
+    [shard:*]
+    HOST (str): the shard's host
+    WEIGHT (float:1.0): the shard's weight
+    URL (str:"http://${HOST}/${cluster:NAME}"): computed per shard
+
+    [shard:backup:*]
+    HOST (str:"backup"): backups match the longest prefix
+    '''
+    pass
+
+
+def test_pattern_sections(tmp_path):
+    text = ''.join(
+        '[shard:{0}]\nHOST=host{0}\nWEIGHT={0}\n'.format(i)
+        for i in range(100)
+    ) + '[shard:backup:0]\n[unrelated]\nX=1\n'
+    path = tmp_path / 'shards.cfg'
+    path.write_text(text)
+    for conf in (
+        ShardConfig.load(text=text),
+        ShardConfig.load(path=str(path), mmap=True),
+    ):
+        shards = dict(conf.sections('shard:*'))
+        assert len(shards) == 100
+        assert shards['shard:7'] is conf['SHARD:7']
+        assert conf['shard:7']['weight'] == 7.0
+        assert conf['shard:7']['url'] == 'http://host7/main'
+        assert dict(conf.sections('shard:backup:*')) == {
+            'shard:backup:0': {'HOST': 'backup'},
+        }
+        assert 'unrelated' not in conf
+        assert len(list(conf.sections())) == 102
+    # No matching sections is fine.
+    assert list(ShardConfig.load(text='').sections('shard:*')) == []
+    with pytest.raises(KeyError):
+        ShardConfig.load(text='').sections('nope:*')
+    # Every matching section is validated against the schema.
+    with pytest.raises(DoconfBadConfigError):
+        ShardConfig.load(text='[shard:1]\nHOST=a\n[shard:2]\nWEIGHT=2\n')
+
+
+def test_pattern_sections_bad_pattern():
+    with pytest.raises(DoconfClassError):
+        class BadConfig(DoconfConfig):
+            '''
+            name: myapp
+            {DEFAULT}
+            [shard:*:data]
+            HOST (str:"a"): the host
+            '''
+            pass
+
+
+class WeightsConfig(DoconfConfig):
+    '''
+    name: doconf_weights
+
+    {DEFAULT}
+
+    [limits] (array)
+    LOW (int:1): lower bound
+    HIGH (int:100): upper bound
+    STRICT (bool:false): whether to enforce them
+
+    [weights] (array)
+    A (float:0.5): weight of a
+    B (float:0.25): weight of b
+    COUNT (int:3): stored as a double, read back as an int
+    '''
+    pass
+
+
+def test_array_sections():
+    conf = WeightsConfig.load(text='[limits]\nHIGH=200\nSTRICT=true\n')
+    limits = conf['limits']
+    assert limits.array.typecode == 'q'
+    assert list(limits.array) == [1, 200, 1]
+    assert limits['high'] == 200
+    assert limits['strict'] is True
+    assert 'low' in limits and 'nope' not in limits
+    assert limits.get('nope') is None
+    weights = conf['weights']
+    assert weights.array.typecode == 'd'
+    assert weights['count'] == 3 and isinstance(weights['count'], int)
+    assert list(weights.take(['b', 'a'])) == [0.25, 0.5]
+    assert memoryview(weights.array).format == 'd'
+    assert conf._values == {
+        'limits': {'LOW': 1, 'HIGH': 200, 'STRICT': True},
+        'weights': {'A': 0.5, 'B': 0.25, 'COUNT': 3},
+    }
+    restored = WeightsConfig.loads(conf.dumps())
+    assert list(restored['limits'].array) == [1, 200, 1]
+    conf.update('weights', A=2.0)
+    assert conf['weights']['a'] == 2.0
+    assert weights['a'] == 0.5
+    with pytest.raises(DoconfBadConfigError):
+        WeightsConfig.load(text='[limits]\nHIGH=null\n')
+    # Too big to be stored exactly as a double.
+    with pytest.raises(DoconfBadConfigError):
+        WeightsConfig.load(text='[weights]\nCOUNT=9007199254740993\n')
+    conf = WeightsConfig.load(text='[weights]\nCOUNT=9007199254740992\n')
+    assert conf['weights']['count'] == 2 ** 53
+
+
+def test_array_sections_bad_type():
+    with pytest.raises(DoconfClassError):
+        class BadConfig(DoconfConfig):
+            '''
+            name: myapp
+            {DEFAULT}
+            [limits] (array)
+            NAME (str:"a"): not a number
+            '''
+            pass
+    with pytest.raises(DoconfClassError):
+        class BadConfig2(DoconfConfig):
+            '''
+            name: myapp
+            {DEFAULT}
+            [limits] (sparse)
+            LOW (int:1): unknown flag
+            '''
+            pass
+
+
+register_fragment('unittest.logging', '''
+    [logger]
+    LOG_LEVEL (str:"info"): the log level
+    LOG_PATH (str:"/var/log/app.log"): the log path
+''')
+
+
+class FirstIncludeConfig(DoconfConfig):
+    '''
+    name: doconf_first
+
+    {DEFAULT}
+    @include unittest.logging
+
+    [server]
+    PORT (int:8080): the port
+
+    {PRODUCTION}
+    @include unittest.logging
+    '''
+    pass
+
+
+class SecondIncludeConfig(DoconfConfig):
+    '''
+    name: doconf_second
+
+    {DEFAULT}
+    [server]
+    HOST (str:"localhost"): the host
+    @include unittest.logging
+    '''
+    pass
+
+
+def test_fragments():
+    conf = FirstIncludeConfig.load(text='[logger]\nLOG_LEVEL=debug\n')
+    assert conf['logger']['log_level'] == 'debug'
+    assert conf['server']['port'] == 8080
+    conf = SecondIncludeConfig.load(text='')
+    assert conf['logger']['log_path'] == '/var/log/app.log'
+    assert conf['server']['host'] == 'localhost'
+    # Parsed once and shared by reference.
+    first = FirstIncludeConfig._ENVS['default'].section_by_name['logger']
+    assert first is FirstIncludeConfig._ENVS['production'].section_by_name[
+        'logger'
+    ]
+    assert first is SecondIncludeConfig._ENVS['default'].section_by_name[
+        'logger'
+    ]
+    # Registering the same fragment again is a no-op, but not a different one.
+    register_fragment('unittest.logging', '''
+    [logger]
+    LOG_LEVEL (str:"info"): the log level
+    LOG_PATH (str:"/var/log/app.log"): the log path
+''')
+    with pytest.raises(DoconfClassError):
+        register_fragment('unittest.logging', '[logger]\nX (int:1): x')
+
+
+def test_fragment_errors():
+    with pytest.raises(DoconfClassError):
+        class UnknownConfig(DoconfConfig):
+            '''
+            name: myapp
+            {DEFAULT}
+            @include unittest.nope
+            '''
+            pass
+    with pytest.raises(DoconfClassError):
+        class DuplicateConfig(DoconfConfig):
+            '''
+            name: myapp
+            {DEFAULT}
+            [logger]
+            X (int:1): x
+            @include unittest.logging
+            '''
+            pass
+    with pytest.raises(DoconfClassError):
+        register_fragment('unittest.bad', '{DEFAULT}\n[a]\nX (int:1): x')